@@ -5,6 +5,8 @@
 # SPDX-License-Identifier: BSD-2-Clause
 
 from re import M
+from math import log2
+
 from migen import *
 from migen.genlib.cdc import MultiReg
 
@@ -15,7 +17,8 @@ from litex.soc.interconnect.csr import *
 
 class N64Cart(Module, AutoCSR):
 
-    def __init__(self, pads, sdram_port, sdram_wait, mailbox_bus_r, mailbox_bus_w, fast_cd="sys2x"):
+    def __init__(self, pads, sdram_port, sdram_wait, mailbox_bus_r, mailbox_bus_w, fast_cd="sys2x",
+        bulk_offset=0, bulk_size=0):
         self.pads = pads
 
         self.logger_idx = CSRStatus(32, description="Logger index")
@@ -55,12 +58,19 @@ class N64Cart(Module, AutoCSR):
             self.logger_threshold.storage,
             self.rom_header,
             mailbox_bus_r,
-            mailbox_bus_w
+            mailbox_bus_w,
+            bulk_offset,
+            bulk_size,
         )
 
 
+# N64 address of the optional SDRAM bulk window, 1 MB above the mailbox
+BULK_WINDOW_BASE = 0x1000_0000 + 64*1024*1024 + 0x10_0000
+
+
 class N64CartBus(Module):
-    def __init__(self, pads, sdram_port, sdram_wait, logger_wr, logger_words, logger_threshold, rom_header_csr, mailbox_bus_r, mailbox_bus_w):
+    def __init__(self, pads, sdram_port, sdram_wait, logger_wr, logger_words, logger_threshold, rom_header_csr, mailbox_bus_r, mailbox_bus_w,
+        bulk_offset=0, bulk_size=0):
         self.pads = pads
 
         self.cold_reset = n64_cold_reset = Signal()
@@ -109,6 +119,19 @@ class N64CartBus(Module):
         self.custom_sel = custom_sel = Signal()
         self.mailbox_r_sel = mailbox_r_sel = Signal()
         self.mailbox_w_sel = mailbox_w_sel = Signal()
+        self.bulk_sel = bulk_sel = Signal()
+
+        # The bulk window maps N64 BULK_WINDOW_BASE to SDRAM bulk_offset
+        if bulk_size:
+            bulk_bits = int(log2(bulk_size))
+            assert(bulk_size == 1 << bulk_bits)
+            assert(bulk_offset % bulk_size == 0)
+            assert(BULK_WINDOW_BASE % bulk_size == 0)
+            assert(bulk_offset + bulk_size <= 32*1024*1024)
+
+        # SDRAM is accessed through both the ROM area and the bulk window
+        self.sdram_access = sdram_access = Signal()
+        self.comb += sdram_access.eq(sdram_sel | bulk_sel)
 
         # Kind of a hacky address decoder, but it works for now.
         self.comb += \
@@ -126,6 +149,9 @@ class N64CartBus(Module):
                 ).Elif((n64_addr >= (0x1000_0000 + 64*1024*1024 + 0x100)) & (n64_addr < (0x1000_0000 + 64*1024*1024 + 0x200)),
                     # 0x14000100
                     mailbox_r_sel.eq(1),
+                ).Elif((n64_addr >= BULK_WINDOW_BASE) & (n64_addr < BULK_WINDOW_BASE + bulk_size),
+                    # 0x14100000
+                    bulk_sel.eq(1),
                 )
             )
 
@@ -134,10 +160,20 @@ class N64CartBus(Module):
         sdram_data   = Signal(16)
         n64_ad_out_r = Signal(16)
 
+        # 16-bit word address in SDRAM
+        sdram_addr = Signal(26)
+        if bulk_size:
+            self.comb += sdram_addr.eq(Mux(bulk_sel,
+                Cat(n64_addr[1:bulk_bits], Constant(bulk_offset >> bulk_bits, 27 - bulk_bits)),
+                n64_addr[1:27],
+            ))
+        else:
+            self.comb += sdram_addr.eq(n64_addr[1:27])
+
         self.comb += [
             # 16 bit
             # sdram_port.cmd.addr.eq(Mux(n64_write, n64_addr[1:27], n64_addr[1:27] ^ 1)),
-            sdram_port.cmd.addr.eq(n64_addr[1:27]),
+            sdram_port.cmd.addr.eq(sdram_addr),
 
             sdram_port.cmd.we.eq(0),
             sdram_port.rdata.ready.eq(1),
@@ -148,7 +184,7 @@ class N64CartBus(Module):
             # port.cmd.last.eq(~wishbone.we), # Always wait for reads.
             # port.flush.eq(~wishbone.cyc)    # Flush writes when transaction ends.
 
-            If((n64_addr[2:27] == 0) & (rom_header_csr.storage != 0),
+            If(sdram_sel & (n64_addr[2:27] == 0) & (rom_header_csr.storage != 0),
                 # Configure the bus to run at a slower speed *for now*
                 # 50 MHz = 20ns
                 #
@@ -188,7 +224,7 @@ class N64CartBus(Module):
         self.comb += mailbox_bus_w.adr.eq(n64_addr >> 2)
 
         self.sync += \
-        If(sdram_sel,
+        If(sdram_access,
             If(sdram_port.rdata.valid, n64_ad_out_r.eq(sdram_data))
         ).Elif(custom_sel,
             n64_ad_out_r.eq(custom_data),
@@ -260,8 +296,8 @@ class N64CartBus(Module):
         # Performs the read as well.
         fsm.act("WAIT_READ_WRITE",
 
-            # ------------ SDRAM
-            If(sdram_sel,
+            # ------------ SDRAM (ROM area and bulk window)
+            If(sdram_access,
                 sdram_wait.eq(0),
                 If(n64_read_active,
                     # Save one cycle latency by using rdata.valid - when this signal is high,
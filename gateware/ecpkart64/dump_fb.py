@@ -7,12 +7,21 @@
 # SPDX-License-Identifier: BSD-2-Clause
 
 import os
+import time
+import hashlib
 import argparse
-import struct
+import subprocess
 
+from queue import Queue
+from threading import Thread
+
+import numpy as np
 from PIL import Image
+from litex import RemoteClient
+
+from .util.dump import Dumper
 
-from .util.dump import dump_array
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".webm", ".mov")
 
 def parse_args():
     parser = argparse.ArgumentParser(description="""ECPKart64 Dump Utility""")
@@ -20,11 +29,127 @@ def parse_args():
     parser.add_argument("--address", default=0x40000000, type=lambda x: int(x, 0))
     parser.add_argument("--width", default=320, type=lambda x: int(x, 0))
     parser.add_argument("--height", default=240, type=lambda x: int(x, 0))
-    parser.add_argument("--bpp", default=4, type=lambda x: int(x, 0))
+    parser.add_argument("--bpp", default=4, type=lambda x: int(x, 0), help="Bytes per pixel, 2 for RGBA5551 or 4 for RGBA8888")
     parser.add_argument("--file", default="dump.png", type=str)
+    parser.add_argument("--capture", default=False, action="store_true", help="Capture continuously to an image sequence, or a video if --file is one")
+    parser.add_argument("--frames", default=None, type=int, help="Stop capturing after this many frames")
+    parser.add_argument("--interval", default=0.0, type=float, help="Minimum seconds between captured frames")
+    parser.add_argument("--tile", default=32, type=int, help="Tile size in pixels for detecting unchanged frames")
     args = parser.parse_args()
     return args
 
+def decode(data, width, height, bpp):
+    """Decodes a framebuffer dump into a height x width x 4 RGBA array.
+
+    The dump has every 16-bit halfword swapped relative to the N64's
+    big-endian framebuffer, so 16-bit pixels read as little-endian.
+    """
+    if bpp == 4:
+        raw = np.frombuffer(data, dtype=np.uint8, count=width * height * 4)
+        return raw.reshape(-1, 2)[:, ::-1].reshape(height, width, 4)
+
+    if bpp == 2:
+        px = np.frombuffer(data, dtype="<u2", count=width * height).reshape(height, width)
+        rgba = np.empty((height, width, 4), dtype=np.uint8)
+        for i, shift in enumerate((11, 6, 1)):
+            c = ((px >> shift) & 0x1f).astype(np.uint8)
+            # Expand 5 to 8 bits so full scale maps to 255
+            rgba[..., i] = (c << 3) | (c >> 2)
+        rgba[..., 3] = (px & 1) * 255
+        return rgba
+
+    raise ValueError(f"Unsupported framebuffer depth of {bpp} bytes per pixel")
+
+def tile_hashes(data, width, height, bpp, tile):
+    """Hashes the raw framebuffer in tile x tile pixel blocks."""
+    raw = np.frombuffer(data, dtype=np.uint8, count=width * height * bpp).reshape(height, width * bpp)
+    step = tile * bpp
+    return [hashlib.blake2b(np.ascontiguousarray(raw[y:y + tile, x:x + step]), digest_size=8).digest()
+            for y in range(0, height, tile) for x in range(0, width * bpp, step)]
+
+def sequence_name(path, index):
+    root, ext = os.path.splitext(path)
+    return f"{root}_{index:05d}{ext}"
+
+class ImageWriter():
+    """Saves frames as numbered images from a thread, so reading isn't held up."""
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = Queue(maxsize=8)
+        self.index = open(f"{os.path.splitext(path)[0]}.csv", "w")
+        self.index.write("frame,time,file\n")
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            name, rgba = item
+            Image.fromarray(rgba, mode="RGBA").save(name, compress_level=1)
+
+    def write(self, frame, timestamp, rgba):
+        name = sequence_name(self.path, frame)
+        self.index.write(f"{frame},{timestamp:.3f},{os.path.basename(name)}\n")
+        self.queue.put((name, rgba))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.index.close()
+
+class VideoWriter():
+    """Pipes frames to ffmpeg, timestamped on arrival so skipped frames just last longer."""
+
+    def __init__(self, path, width, height):
+        self.process = subprocess.Popen([
+            "ffmpeg", "-loglevel", "error", "-y",
+            "-use_wallclock_as_timestamps", "1",
+            "-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{width}x{height}", "-i", "-",
+            "-fps_mode", "vfr", "-pix_fmt", "yuv420p", path,
+        ], stdin=subprocess.PIPE)
+
+    def write(self, frame, timestamp, rgba):
+        self.process.stdin.write(rgba.tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+def capture(dumper, args):
+    size = args.width * args.height * args.bpp
+    if args.file.lower().endswith(VIDEO_EXTENSIONS):
+        writer = VideoWriter(args.file, args.width, args.height)
+    else:
+        writer = ImageWriter(args.file)
+
+    hashes = None
+    captured = written = 0
+    t0 = time.monotonic()
+    try:
+        while args.frames is None or captured < args.frames:
+            t = time.monotonic()
+            data = dumper.dump(args.address, size)
+            captured += 1
+
+            current = tile_hashes(data, args.width, args.height, args.bpp, args.tile)
+            changed = len(current) if hashes is None else sum(a != b for a, b in zip(current, hashes))
+            hashes = current
+            if changed:
+                writer.write(written, t - t0, decode(data, args.width, args.height, args.bpp))
+                written += 1
+            print(f"\rFrame {captured}: {changed}/{len(current)} tiles changed, {written} written, "
+                  f"{captured / (time.monotonic() - t0):.2f} fps", end="", flush=True)
+
+            time.sleep(max(args.interval - (time.monotonic() - t), 0))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print()
+        writer.close()
+
 def main():
     args = parse_args()
 
@@ -33,26 +158,19 @@ def main():
         raise ValueError("{} not found. This is necessary to load the 'regs' of the remote. Try setting --csr-csv here to "
                          "the path to the --csr-csv argument of the SoC build.".format(args.csr_csv))
 
-    words = args.width * args.height * args.bpp // 4
-    data = dump_array(args.csr_csv, args.address, words)
-
-    # Byte swap
-    swapped = []
-    for word in data:
-        v0 = word         & 0xff
-        v1 = (word >>  8) & 0xff
-        v2 = (word >> 16) & 0xff
-        v3 = (word >> 24) & 0xff
-        swapped.append(v1)
-        swapped.append(v0)
-        swapped.append(v3)
-        swapped.append(v2)
-
-    buffer = struct.pack(f"<{len(swapped)}B", *swapped)
+    bus = RemoteClient(csr_csv=args.csr_csv)
+    bus.open()
 
-    mode = "RGBA"
+    try:
+        dumper = Dumper(bus)
+        if args.capture:
+            capture(dumper, args)
+            return
+        data = dumper.dump(args.address, args.width * args.height * args.bpp)
+    finally:
+        bus.close()
 
-    img = Image.frombuffer(mode=mode, data=buffer, size=(args.width, args.height))
+    img = Image.fromarray(decode(data, args.width, args.height, args.bpp), mode="RGBA")
     img.save(args.file)
 
 if __name__ == "__main__":
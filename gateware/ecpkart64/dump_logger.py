@@ -9,36 +9,107 @@
 import os
 import argparse
 
+import numpy as np
 from litex import RemoteClient
 
+from .util.dump import Dumper
+
+# Size of the logger memory, see cart/__init__.py
+LOGGER_WORDS = 4096
+
 def parse_args():
-    parser = argparse.ArgumentParser(description="""ECPKart64 Dump Utility""")
+    parser = argparse.ArgumentParser(description="""ECPKart64 Logger Utility""")
     parser.add_argument("--csr-csv", default="csr.csv", help="SoC CSV file")
+    parser.add_argument("--load", nargs="+", default=None, help="Analyse saved captures instead of reading the logger")
+    parser.add_argument("--save", default=None, help="Save the entries, oldest first, as 32-bit little-endian words")
+    parser.add_argument("--threshold", default=None, type=int, help="Logger threshold, read from the SoC when not loading captures")
+    parser.add_argument("--budget", default=14, type=int, help="Stall cycles the PI timing allows, 14 (280 ns) with the 0x1240 config")
+    parser.add_argument("--clk-freq", default=50e6, type=float, help="Frequency of the cart bus clock domain")
+    parser.add_argument("--bins", default=16, type=int, help="Number of histogram bins")
+    parser.add_argument("--hex", default=False, action="store_true", help="Also print every entry")
     args = parser.parse_args()
     return args
 
+def order_entries(words, idx):
+    """Returns the logged entries oldest first.
+
+    The logger increments its index before each write, so slot 0 is only
+    written once the index wraps. The memory starts out zeroed and every
+    entry is larger than the threshold, so a non-zero slot past the index
+    means it has wrapped and the whole ring holds entries.
+    """
+    words = np.asarray(words, dtype=np.uint32)
+    idx %= len(words)
+    if words[idx + 1:].any() or (idx != 0 and words[0]):
+        return np.roll(words, -(idx + 1))
+    return words[1:idx + 1]
+
+def read_logger(bus):
+    idx = bus.regs.n64_logger_idx.read()
+    data = Dumper(bus).dump(bus.mems.n64slave.base, LOGGER_WORDS * 4)
+    # The logger keeps running while it's read, take the index again
+    if bus.regs.n64_logger_idx.read() != idx:
+        print("Warning: the logger advanced while it was read")
+    return order_entries(np.frombuffer(data, dtype="<u4"), idx)
+
+def report(name, entries, threshold, budget, clk_freq, bins):
+    ns = 1e9 / clk_freq
+    # A capture may have been logged with a lower threshold than asked for
+    below = int(np.count_nonzero(entries <= threshold))
+    entries = entries[entries > threshold]
+    print(f"{name}: {len(entries)} stalls over the threshold of {threshold} cycles ({threshold * ns:.0f} ns)")
+    if below:
+        print(f"  Ignored {below} entries at or below the threshold")
+    if not len(entries):
+        return
+
+    over = int(np.count_nonzero(entries > budget))
+    print(f"  Over the PI budget of {budget} cycles ({budget * ns:.0f} ns): {over} ({100 * over / len(entries):.1f}%)")
+    print(f"  Min {entries.min()}, mean {entries.mean():.1f}, max {entries.max()} cycles")
+    percentiles = (50, 90, 99, 99.9)
+    values = np.percentile(entries, percentiles)
+    print("  " + ", ".join(f"p{p}: {v:.1f}" for p, v in zip(percentiles, values)))
+
+    # Integer bins starting just above the threshold, so each bin is whole cycles
+    lo = threshold + 1
+    width = max(1, -(-(int(entries.max()) + 1 - lo) // bins))
+    counts, edges = np.histogram(entries, bins=np.arange(lo, int(entries.max()) + width + 1, width))
+    scale = 50 / counts.max()
+    for count, edge in zip(counts, edges):
+        label = f"{edge}" if width == 1 else f"{edge}-{edge + width - 1}"
+        mark = "!" if edge + width - 1 > budget else " "
+        print(f"  {label:>9} {mark} {count:6d} {'#' * int(round(count * scale))}")
+
 def main():
     args = parse_args()
 
-    # Create and open remote control.
-    if not os.path.exists(args.csr_csv):
-        raise ValueError("{} not found. This is necessary to load the 'regs' of the remote. Try setting --csr-csv here to "
-                         "the path to the --csr-csv argument of the SoC build.".format(args.csr_csv))
-    bus = RemoteClient(csr_csv=args.csr_csv)
-    bus.open()
-
-    log_entries = bus.regs.n64_logger_idx.read()
-    print(f"Log entries: {log_entries + 1}")
+    if args.load:
+        captures = [(path, np.fromfile(path, dtype="<u4")) for path in args.load]
+        threshold = args.threshold if args.threshold is not None else 6
+    else:
+        # Create and open remote control.
+        if not os.path.exists(args.csr_csv):
+            raise ValueError("{} not found. This is necessary to load the 'regs' of the remote. Try setting --csr-csv here to "
+                             "the path to the --csr-csv argument of the SoC build.".format(args.csr_csv))
+        bus = RemoteClient(csr_csv=args.csr_csv)
+        bus.open()
 
-    base = bus.mems.n64slave.base
+        try:
+            threshold = args.threshold
+            if threshold is None:
+                threshold = bus.regs.n64_logger_threshold.read()
+            captures = [("Logger", read_logger(bus))]
+        finally:
+            bus.close()
 
-    try:
-        for addr in range(base, base + log_entries * 4, 4):
-            value = bus.read(addr)
-            print(f"{(addr - base)//4:04X}: {value:08X}")
+        if args.save:
+            captures[0][1].astype("<u4").tofile(args.save)
 
-    finally:
-        bus.close()
+    for name, entries in captures:
+        if args.hex:
+            for i, value in enumerate(entries):
+                print(f"{i:04X}: {value:08X}")
+        report(name, entries, threshold, args.budget, args.clk_freq, args.bins)
 
 if __name__ == "__main__":
     main()
@@ -12,14 +12,15 @@ import binascii
 
 from litex import RemoteClient
 
-from .util.dump import dump_binary
+from .util.dump import Dumper
 
 def parse_args():
     parser = argparse.ArgumentParser(description="""ECPKart64 Dump Utility""")
     parser.add_argument("--csr-csv", default="csr.csv", help="SoC CSV file")
     parser.add_argument("--address", default=0x40000000, type=lambda x: int(x, 0))
-    parser.add_argument("--length", default=64, type=lambda x: int(x, 0))
-    parser.add_argument("--file", default=None, type=argparse.FileType('wb'))
+    parser.add_argument("--length", default=64, type=lambda x: int(x, 0), help="Length in 32-bit words")
+    parser.add_argument("--file", default=None, type=str)
+    parser.add_argument("--resume", default=False, action='store_true', help="Continue an interrupted dump to --file")
     parser.add_argument("--print", default=False, action='store_true')
     args = parser.parse_args()
     return args
@@ -32,11 +33,26 @@ def main():
         raise ValueError("{} not found. This is necessary to load the 'regs' of the remote. Try setting --csr-csv here to "
                          "the path to the --csr-csv argument of the SoC build.".format(args.csr_csv))
 
-    data = dump_binary(args.csr_csv, args.address, args.length)
+    bus = RemoteClient(csr_csv=args.csr_csv)
+    bus.open()
 
-    if args.file is not None:
-        args.file.write(data)
-        args.file.close()
+    length = args.length * 4
+    try:
+        dumper = Dumper(bus)
+        if args.file is not None:
+            offset = dumper.dump_file(args.file, args.address, length, resume=args.resume)
+            if offset:
+                print(f"Resumed at 0x{args.address + offset:08X}")
+            if args.print:
+                with open(args.file, "rb") as f:
+                    data = f.read()
+        elif args.print:
+            data = dumper.dump(args.address, length)
+    finally:
+        bus.close()
+
+    if dumper.bytes:
+        print(f"Read {dumper.bytes} bytes in {dumper.elapsed:.2f}s, {dumper.throughput() / 1e3:.1f} kB/s")
 
     if args.print:
         hexdata = binascii.hexlify(data).decode("utf-8")
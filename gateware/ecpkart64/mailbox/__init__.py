@@ -5,14 +5,33 @@
 # Copyright (c) 2021-2022 Konrad Beckmann <konrad.beckmann@gmail.com
 # SPDX-License-Identifier: BSD-2-Clause
 
-import time
+import json
 
 from litex import RemoteClient
 
 from .types import *
+from .poll import *
+from .metrics import *
+from .ring import *
+from .transport import *
 from ..util.byteswap import *
 
-__all__ = ["Mailbox", "MailboxT"]
+__all__ = [
+    "Mailbox",
+    "AsyncMailbox",
+    "MailboxT",
+    "AsyncMailboxRing",
+    "MAX_SLOTS",
+    "MailboxTimeout",
+    "Poller",
+    "deadline",
+    "MailboxMetrics",
+    "AsyncRemoteClient",
+    "AsyncBusThread",
+    "BlockingBus",
+    "run_blocking",
+    "blocking_attr",
+]
 
 IDLE = int(MailboxStateT.MAILBOX_STATUS_IDLE)
 BUSY = int(MailboxStateT.MAILBOX_STATUS_BUSY)
@@ -24,10 +43,62 @@ def dbg(*args):
         print(*args)
 
 
-class Mailbox():
-    def __init__(self, bus: RemoteClient, address: int):
+PAYLOAD_WORDS = MailboxT.rx_payload.sizeof() // 4
+
+
+class AsyncMailbox():
+    """Host side of the N64 <-> SoC mailbox.
+
+    `bus` is an async transport: AsyncRemoteClient, AsyncBusThread or
+    BlockingBus. See Mailbox for a blocking version.
+
+    With `burst=True` each transfer moves the state, length and payload words
+    in one contiguous bus access instead of one access per field:
+
+    TX: [tx_state=BUSY, tx_state_recv, tx_length, tx_payload...] is written
+        in a single burst followed by tx_state=DONE, so the N64 still sees
+        the BUSY -> DONE -> IDLE sequence and never observes DONE before the
+        payload has landed.
+
+    RX: [rx_state, rx_state_recv, rx_length, rx_payload...] is read in a
+        single burst. The N64 writes rx_state=DONE after the payload, so a
+        burst that starts with DONE always carries a complete payload.
+
+    The final "wait for rx_state=IDLE, then tx_state_recv=IDLE" step of a
+    receive is deferred and completed by whichever poll observes it next.
+    Likewise, an observed rx_state_recv=IDLE lets the next TX skip its
+    initial poll. The N64 side follows the same handshake as without burst.
+
+    All state polling goes through `poller`, which applies `timeout` and
+    backs off while the N64 is busy. A stalled handshake raises
+    MailboxTimeout; call open() to reset the mailbox afterwards. The same
+    applies when a transfer is cancelled half way.
+
+    With `metrics=True` the latency of every handshake phase is recorded in
+    `metrics`, see report() and dump_metrics().
+
+    The mailbox is not safe for concurrent use, AsyncCommander serializes
+    access to it.
+    """
+
+    def __init__(self, bus, address: int, burst=False, timeout=1.0, poller=None, metrics=False):
         self.bus = bus
         self.address = address
+        self.burst = burst
+        self.poller = Poller(timeout=timeout) if poller is None else poller
+        self.metrics = MailboxMetrics() if metrics else None
+
+        # Words moved over the link, split by purpose
+        self.poll_words = 0
+        self.payload_words = 0
+
+        # Burst mode bookkeeping
+        self._tx_state_recv = IDLE
+        self._rx_release_pending = False
+        self._peer_idle = False
+
+        # Set while a transfer is in progress
+        self._active = False
 
         self.rx_state        = address
         self.rx_state_recv   = address +  1 * 4
@@ -39,137 +110,283 @@ class Mailbox():
         self.tx_length       = address + 66 * 4
         self.tx_payload      = address + 67 * 4
 
-    def _writeBytes(self, addr: int, data: bytes):
+    async def _writeBytes(self, addr: int, data: bytes):
         assert(len(data) % 4 == 0)
-        self.bus.write(addr, unpack_uint32_be(data))
+        await self.bus.write(addr, unpack_uint32_be(data))
+
+    async def _writeWord(self, addr: int, word: int):
+        await self.bus.write(addr, word)
+
+    async def _readBytes(self, addr: int, length: int):
+        self.payload_words += length
+        return pack_uint32_le(await self.bus.read(addr, length))
+
+    async def _readWord(self, addr: int) -> int:
+        return bswap32(await self.bus.read(addr))
 
-    def _writeWord(self, addr: int, word: int):
-        self.bus.write(addr, word)
+    async def _readWords(self, addr: int, length: int):
+        return await self.bus.read(addr, length)
 
-    def _readBytes(self, addr: int, length: int):
-        return pack_uint32_le(self.bus.read(addr, length))
+    async def _pollWord(self, addr: int) -> int:
+        self.poll_words += 1
+        return await self._readWord(addr)
 
-    def _readWord(self, addr: int) -> int:
-        return bswap32(self.bus.read(addr))
+    async def _wait(self, poll, what, timeout=None):
+        return await self.poller.wait(poll, what=what, timeout=timeout)
 
-    def tx_payload_write(self, payload):
-        self._writeBytes(self.tx_payload, payload)
-        self._writeWord(self.tx_length, len(payload) // 4)
+    async def _wait_word(self, addr: int, value: int, what, timeout=None):
+        async def poll():
+            return await self._pollWord(addr) == value
+        await self._wait(poll, what, timeout)
 
-    def rx_payload_read(self):
-        length = self._readWord(self.rx_length)
+    async def tx_payload_write(self, payload):
+        self.payload_words += len(payload) // 4
+        await self._writeBytes(self.tx_payload, payload)
+        await self._writeWord(self.tx_length, len(payload) // 4)
+
+    async def rx_payload_read(self):
+        length = await self._readWord(self.rx_length)
         # dbg(f"{length=}")
         assert(length <= MailboxT.rx_payload.sizeof())
-        return self._readBytes(self.rx_payload, length)
+        return await self._readBytes(self.rx_payload, length)
 
-    def open(self, reset=True):
+    async def sync(self, timeout=None):
+        """Waits until the N64 has completed the last handshake."""
+        await self._wait_word(self.rx_state_recv, IDLE, "rx_state_recv=IDLE", timeout)
+
+    async def open(self, reset=True):
         if reset:
-            self.bus.write(self.tx_state, [0] * 64)
-
-        self._writeWord(self.tx_state,      IDLE)
-        self._writeWord(self.tx_state_recv, IDLE)
-
-    def rx(self):
-        dbg("[RX] 1")
-        t = []
-        t.append(time.monotonic())
-        ii = 0
-        while True:
-            ii += 1
-            state = self._readWord(self.rx_state)
-            if state == DONE:
-                break
-            # dbg(f"[RX] 1: {state}")
-            # dbg(f"[RX] rx_state_recv= {self._readWord(self.rx_state_recv)}")
-            # time.sleep(0.1)
-        dbg("[RX] 2")
-
-        t.append(time.monotonic())
-
-        self._writeWord(self.tx_state_recv, BUSY)
-        t.append(time.monotonic())
-        dbg("[RX] 3")
-
-        data = self.rx_payload_read()
-        t.append(time.monotonic())
-        dbg("[RX] 4")
-
-        self._writeWord(self.tx_state_recv, DONE)
-        t.append(time.monotonic())
-        dbg("[RX] 5")
-
-        while True:
-            state = self._readWord(self.rx_state)
-            if state == IDLE:
-                break
-            # dbg(state)
-            # time.sleep(0.1)
-        t.append(time.monotonic())
-
-        dbg("[RX] 6")
-
-        self._writeWord(self.tx_state_recv, IDLE)
-        t.append(time.monotonic())
-        dbg("[RX] 5")
-
-        for i, x in enumerate(t[1:]):
-            dbg(f"{t[i] - t[i-1]:.5f}")
-        dbg(f"total: {t[-1] - t[0]:.5f}")
-
-        dbg(ii)
+            await self.bus.write(self.tx_state, [0] * 64)
+
+        await self._writeWord(self.tx_state,      IDLE)
+        await self._writeWord(self.tx_state_recv, IDLE)
+
+        self._tx_state_recv = IDLE
+        self._rx_release_pending = False
+        self._peer_idle = False
+        self._active = False
+
+    def _begin(self):
+        if self._active:
+            raise RuntimeError("A mailbox transfer was interrupted. Call open() to reset the mailbox.")
+        self._active = True
+
+    def _end(self):
+        self._active = False
+
+    async def _observe(self, rx_state: int, rx_state_recv: int):
+        # The N64 only leaves rx_state_recv=IDLE when we set tx_state=DONE.
+        if rx_state_recv == IDLE:
+            self._peer_idle = True
+
+        # Complete a deferred RX release once the N64 went back to IDLE.
+        if self._rx_release_pending and rx_state == IDLE:
+            await self._writeWord(self.tx_state_recv, IDLE)
+            self._tx_state_recv = IDLE
+            self._rx_release_pending = False
+
+    async def _poll_states(self):
+        self.poll_words += 2
+        rx_state, rx_state_recv = (bswap32(x) for x in await self._readWords(self.rx_state, 2))
+        await self._observe(rx_state, rx_state_recv)
+        return rx_state, rx_state_recv
+
+    async def _wait_states(self, rx_state=None, rx_state_recv=None, what="", timeout=None):
+        async def poll():
+            state, state_recv = await self._poll_states()
+            return ((rx_state is None or state == rx_state) and
+                    (rx_state_recv is None or state_recv == rx_state_recv))
+        await self._wait(poll, what, timeout)
+
+    def stats(self):
+        return dict(
+            poll_words=self.poll_words,
+            payload_words=self.payload_words,
+            **self.poller.stats(),
+        )
+
+    def reset_stats(self):
+        self.poll_words = 0
+        self.payload_words = 0
+        self.poller.reset_stats()
+        if self.metrics:
+            self.metrics.reset()
+
+    def report(self):
+        """Returns the counters and, if enabled, the phase histograms."""
+        stats = self.stats()
+        stats["poll_bytes"] = stats["poll_words"] * 4
+        stats["payload_bytes"] = stats["payload_words"] * 4
+        report = dict(stats=stats)
+        if self.metrics:
+            report["phases"] = self.metrics.as_dict()
+        return report
+
+    def dump_metrics(self, fp):
+        json.dump(self.report(), fp, indent=2)
+
+    async def release(self, timeout=None):
+        """Completes a deferred RX release (burst mode only)."""
+        if self._rx_release_pending:
+            await self._wait_states(rx_state=IDLE, what="rx_state=IDLE", timeout=timeout)
+
+    async def rx(self, length=None, timeout=None):
+        """Receives one payload from the N64.
+
+        `length` is the expected number of payload words. It is only a hint
+        used to size the burst read and is ignored without burst.
+        """
+        self._begin()
+        if self.burst:
+            data = await self._rx_burst(length, timeout)
+        else:
+            data = await self._rx(timeout)
+        self._end()
+        return data
+
+    async def _rx(self, timeout=None):
+        t = self.metrics.start("rx") if self.metrics else None
+
+        await self._wait_word(self.rx_state, DONE, "rx_state=DONE", timeout)
+        if t: t.mark("wait_done")
+
+        await self._writeWord(self.tx_state_recv, BUSY)
+        if t: t.mark("state_write")
+
+        data = await self.rx_payload_read()
+        if t: t.mark("payload_read")
+
+        await self._writeWord(self.tx_state_recv, DONE)
+        if t: t.mark("ack")
+
+        await self._wait_word(self.rx_state, IDLE, "rx_state=IDLE", timeout)
+        if t: t.mark("wait_idle")
+
+        await self._writeWord(self.tx_state_recv, IDLE)
+        if t:
+            t.mark("release")
+            t.done()
 
         return data
 
+    async def _poll_burst(self, words):
+        burst = await self._readWords(self.rx_state, 3 + words)
+        rx_state, rx_state_recv, rx_length = (bswap32(x) for x in burst[:3])
+        await self._observe(rx_state, rx_state_recv)
+        if rx_state != DONE:
+            self.poll_words += len(burst)
+            return None
+        return rx_length, burst
+
+    async def _rx_burst(self, length=None, timeout=None):
+        t = self.metrics.start("rx") if self.metrics else None
+
+        # The previous payload must be released before a new DONE is valid.
+        await self.release(timeout)
+        if t: t.mark("release")
+
+        words = PAYLOAD_WORDS if length is None else min(length, PAYLOAD_WORDS)
+        rx_length, burst = await self._wait(lambda: self._poll_burst(words), "rx_state=DONE", timeout)
+        if t: t.mark("wait_done")
+
+        assert(rx_length <= PAYLOAD_WORDS)
+        payload = burst[3:3 + rx_length]
+        if rx_length > words:
+            payload += await self._readWords(self.rx_payload + words * 4, rx_length - words)
+        self.poll_words += 3 + max(words - rx_length, 0)
+        self.payload_words += rx_length
+        data = pack_uint32_le(payload)
+        if t: t.mark("payload_read")
+
+        await self._writeWord(self.tx_state_recv, BUSY)
+        await self._writeWord(self.tx_state_recv, DONE)
+        self._tx_state_recv = DONE
+        self._rx_release_pending = True
+        if t:
+            t.mark("ack")
+            t.done()
+
+        return data
+
+    async def _tx_burst(self, data, timeout=None):
+        assert(len(data) % 4 == 0)
+        assert(len(data) // 4 <= PAYLOAD_WORDS)
+
+        t = self.metrics.start("tx") if self.metrics else None
 
-    def tx(self, data, padded=True, timeout=1):
-        dbg("[TX] 1")
-        t = []
-        t.append(time.monotonic())
-        ii = 0
-        while True:
-            ii += 1
-            state = self._readWord(self.rx_state_recv)
-            if state == IDLE:
-                break
-            dbg(f"[TX] 1: {state}")
-            # time.sleep(0.1)
-        dbg("[TX] 2")
+        if not self._peer_idle:
+            await self._wait_states(rx_state_recv=IDLE, what="rx_state_recv=IDLE", timeout=timeout)
+        if t: t.mark("wait_idle")
 
-        t.append(time.monotonic())
+        await self.bus.write(self.tx_state,
+            [BUSY, self._tx_state_recv, len(data) // 4] + unpack_uint32_be(data))
+        await self._writeWord(self.tx_state, DONE)
+        self.payload_words += len(data) // 4
+        if t: t.mark("payload_write")
 
-        self._writeWord(self.tx_state, BUSY)
-        t.append(time.monotonic())
-        dbg("[TX] 3")
+        await self._wait_states(rx_state_recv=DONE, what="rx_state_recv=DONE", timeout=timeout)
+        if t: t.mark("wait_ack")
 
+        await self._writeWord(self.tx_state, IDLE)
+        self._peer_idle = False
+        if t:
+            t.mark("release")
+            t.done()
+
+    async def tx(self, data, padded=True, timeout=None):
         if padded:
             padlen = len(data) % 4
             if padlen > 0:
                 data += b'\x00' * (4 - padlen)
-        self.tx_payload_write(data)
-        t.append(time.monotonic())
-        dbg("[TX] 4")
-
-        self._writeWord(self.tx_state, DONE)
-        t.append(time.monotonic())
-        dbg("[TX] 5")
-
-        while True:
-            state = self._readWord(self.rx_state_recv)
-            if state == DONE:
-                break
-            # dbg(f"[TX] rx_state= {self._readWord(self.rx_state)}")
-            # dbg(f"[TX] rx_state_recv= {state}")
-            # time.sleep(0.1)
-        t.append(time.monotonic())
-
-        dbg("[TX] 6")
-
-        self._writeWord(self.tx_state, IDLE)
-        t.append(time.monotonic())
-        dbg("[TX] 7")
-
-        for i, x in enumerate(t[1:]):
-            dbg(f"{t[i] - t[i-1]:.5f}")
-        dbg(f"total: {t[-1] - t[0]:.5f}")
-
-        dbg(ii)
+
+        self._begin()
+        if self.burst:
+            await self._tx_burst(data, timeout)
+        else:
+            await self._tx(data, timeout)
+        self._end()
+
+    async def _tx(self, data, timeout=None):
+        t = self.metrics.start("tx") if self.metrics else None
+
+        await self._wait_word(self.rx_state_recv, IDLE, "rx_state_recv=IDLE", timeout)
+        if t: t.mark("wait_idle")
+
+        await self._writeWord(self.tx_state, BUSY)
+        if t: t.mark("state_write")
+
+        await self.tx_payload_write(data)
+        await self._writeWord(self.tx_state, DONE)
+        if t: t.mark("payload_write")
+
+        await self._wait_word(self.rx_state_recv, DONE, "rx_state_recv=DONE", timeout)
+        if t: t.mark("wait_ack")
+
+        await self._writeWord(self.tx_state, IDLE)
+        if t:
+            t.mark("release")
+            t.done()
+
+
+class Mailbox():
+    """Blocking wrapper around AsyncMailbox for a RemoteClient."""
+
+    def __init__(self, bus: RemoteClient, address: int, burst=False, timeout=1.0, poller=None, metrics=False):
+        self.bus = bus
+        self.async_mailbox = AsyncMailbox(BlockingBus(bus), address, burst=burst, timeout=timeout,
+            poller=poller, metrics=metrics)
+
+    def __getattr__(self, name):
+        return blocking_attr(self.async_mailbox, name)
+
+    def open(self, reset=True):
+        run_blocking(self.async_mailbox.open(reset))
+
+    def release(self, timeout=None):
+        run_blocking(self.async_mailbox.release(timeout))
+
+    def rx(self, length=None, timeout=None):
+        return run_blocking(self.async_mailbox.rx(length, timeout))
+
+    def tx(self, data, padded=True, timeout=None):
+        run_blocking(self.async_mailbox.tx(data, padded, timeout))
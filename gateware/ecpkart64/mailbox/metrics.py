@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#
+# This file is part of ECPKart64.
+#
+# Copyright (c) 2022 Konrad Beckmann <konrad.beckmann@gmail.com
+# SPDX-License-Identifier: BSD-2-Clause
+
+import time
+
+
+__all__ = ["Histogram", "MailboxMetrics"]
+
+
+class Histogram():
+    """Latency histogram with power-of-two microsecond buckets.
+
+    Bucket n counts samples in [2^n, 2^(n+1)) us, bucket 0 also holds
+    everything below 1 us.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        us = seconds * 1e6
+        bucket = max(int(us).bit_length() - 1, 0)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile, in seconds."""
+        if self.count == 0:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min((2 << bucket) * 1e-6, self.max)
+        return self.max
+
+    def as_dict(self):
+        return dict(
+            count=self.count,
+            total=self.total,
+            mean=self.total / self.count if self.count else None,
+            min=self.min,
+            max=self.max,
+            p50=self.percentile(50),
+            p99=self.percentile(99),
+            buckets_us={1 << b: n for b, n in sorted(self.buckets.items())},
+        )
+
+
+class PhaseTimer():
+    def __init__(self, metrics, op):
+        self.metrics = metrics
+        self.op = op
+        self.t0 = self.t = time.monotonic()
+
+    def mark(self, phase):
+        """Records the time since the previous mark as `phase`."""
+        now = time.monotonic()
+        self.metrics.record(self.op, phase, now - self.t)
+        self.t = now
+
+    def done(self):
+        self.metrics.record(self.op, "total", time.monotonic() - self.t0)
+
+
+class MailboxMetrics():
+    """Per-phase latency histograms for mailbox transfers.
+
+    Mailboxes only collect metrics when one is attached, a disabled mailbox
+    pays a single None check per phase.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.phases = {}
+
+    def start(self, op):
+        return PhaseTimer(self, op)
+
+    def record(self, op, phase, seconds):
+        key = (op, phase)
+        histogram = self.phases.get(key)
+        if histogram is None:
+            histogram = self.phases[key] = Histogram()
+        histogram.add(seconds)
+
+    def as_dict(self):
+        d = {}
+        for (op, phase), histogram in sorted(self.phases.items()):
+            d.setdefault(op, {})[phase] = histogram.as_dict()
+        return d
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#
+# This file is part of ECPKart64.
+#
+# Copyright (c) 2022 Konrad Beckmann <konrad.beckmann@gmail.com
+# SPDX-License-Identifier: BSD-2-Clause
+
+import time
+import asyncio
+
+
+__all__ = ["Poller", "MailboxTimeout", "deadline"]
+
+
+class MailboxTimeout(TimeoutError):
+    def __init__(self, what, elapsed, polls):
+        super().__init__(f"Timed out after {elapsed:.3f}s ({polls} polls) waiting for {what}")
+        self.what = what
+        self.elapsed = elapsed
+        self.polls = polls
+
+
+class Poller():
+    """Polls a condition with a deadline and adaptive backoff.
+
+    The first `spin` polls are issued back to back. After that the poller
+    sleeps between polls, starting at `min_sleep` and doubling up to
+    `max_sleep`, so a stalled N64 does not keep the link and the host CPU
+    busy. A `timeout` of None waits forever.
+    """
+
+    def __init__(self, timeout=1.0, spin=16, min_sleep=50e-6, max_sleep=10e-3):
+        self.timeout = timeout
+        self.spin = spin
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.polls = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.sleep_time = 0.0
+        self.timeouts = 0
+
+    def stats(self):
+        return dict(
+            polls=self.polls,
+            waits=self.waits,
+            wait_time=self.wait_time,
+            sleep_time=self.sleep_time,
+            timeouts=self.timeouts,
+        )
+
+    async def wait(self, poll, what="condition", timeout=None):
+        """Awaits `poll()` until it returns something truthy and returns it.
+
+        Raises MailboxTimeout if `timeout` (or the default timeout) expires.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        t0 = time.monotonic()
+        expires = None if timeout is None else t0 + timeout
+        sleep = self.min_sleep
+        polls = 0
+
+        try:
+            while True:
+                polls += 1
+                result = await poll()
+                if result:
+                    return result
+
+                now = time.monotonic()
+                if expires is not None and now >= expires:
+                    self.timeouts += 1
+                    raise MailboxTimeout(what, now - t0, polls)
+
+                if polls > self.spin:
+                    delay = sleep if expires is None else min(sleep, expires - now)
+                    await asyncio.sleep(delay)
+                    self.sleep_time += delay
+                    sleep = min(sleep * 2, self.max_sleep)
+        finally:
+            self.polls += polls
+            self.waits += 1
+            self.wait_time += time.monotonic() - t0
+
+
+async def deadline(awaitable, timeout, what="operation"):
+    """Awaits `awaitable`, raising MailboxTimeout if it takes longer than `timeout`."""
+    if timeout is None:
+        return await awaitable
+
+    t0 = time.monotonic()
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise MailboxTimeout(what, time.monotonic() - t0, 0) from None
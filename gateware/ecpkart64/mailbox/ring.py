@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+#
+# This file is part of ECPKart64.
+#
+# Copyright (c) 2022 Konrad Beckmann <konrad.beckmann@gmail.com
+# SPDX-License-Identifier: BSD-2-Clause
+
+import random
+
+from collections import deque
+
+from .poll import *
+from ..util.byteswap import *
+
+__all__ = ["AsyncMailboxRing", "MAX_SLOTS"]
+
+MAILBOX_WORDS = 64
+SEQ_MASK = 0xffff_ffff
+
+# The largest command header, a batch header plus one op, and a data word
+MIN_PAYLOAD_WORDS = 2 + 3 + 1
+# Each slot also holds its seq and length words
+MAX_SLOTS = (MAILBOX_WORDS - 1) // (MIN_PAYLOAD_WORDS + 2)
+
+
+def seq_diff(a, b):
+    """Signed distance a - b between two 32-bit sequence numbers."""
+    d = (a - b) & SEQ_MASK
+    return d - (1 << 32) if d & 0x8000_0000 else d
+
+
+class AsyncMailboxRing():
+    """Sequence-numbered slot ring on top of the mailbox RAMs.
+
+    Each 64-word mailbox RAM is split into one ack word followed by `slots`
+    slots of `slot_words` words: [seq, length, payload...].
+
+    Host -> N64 (mailbox_ram_w, +0x100):
+        word 0:  tx_ack, seq of the last response consumed by the host
+        slot n:  command with seq s where s % slots == n
+
+    N64 -> Host (mailbox_ram_r, +0x000):
+        word 0:  rx_ack, seq of the last command consumed by the N64
+        slot n:  response to the command with seq s where s % slots == n
+
+    Both sides write length and payload before the seq word, so a slot with
+    the expected seq always holds a complete message. The host may have up
+    to `slots` commands in flight (seq - rx_ack <= slots). The N64 consumes
+    commands in order, updates rx_ack, and waits for tx_ack >= seq - slots
+    before it reuses a response slot.
+
+    The ring is entered with COMMAND_RING over the regular handshake, which
+    carries the slot count and the first seq (`base`). The N64 clears its
+    slots and then sets rx_ack = base - 1, which open() waits for.
+    """
+
+    def __init__(self, bus, address: int, slots=3, poller=None, base=None):
+        if not 1 <= slots <= MAX_SLOTS:
+            raise ValueError(f"A mailbox ring holds 1 to {MAX_SLOTS} slots, not {slots}")
+        self.bus = bus
+        self.address = address
+        self.slots = slots
+        self.slot_words = (MAILBOX_WORDS - 1) // slots
+        self.payload_words = self.slot_words - 2
+        self.poller = Poller() if poller is None else poller
+
+        # Legacy state words are small, so a large base never looks acked.
+        self.base = random.randrange(0x100, 0x8000_0000) if base is None else base
+
+        self.rx_ack = address
+        self.tx_ack = address + MAILBOX_WORDS * 4
+
+        self._next_seq = self.base
+        self._acked = (self.base - 1) & SEQ_MASK
+        self._collected = (self.base - 1) & SEQ_MASK
+        self._tx_acked = self._collected
+        self._pending = deque()
+        self._rx = None
+
+    def _tx_slot(self, seq: int):
+        return self.tx_ack + (1 + (seq % self.slots) * self.slot_words) * 4
+
+    async def _poll_ack(self):
+        self._acked = bswap32(await self.bus.read(self.rx_ack))
+        return self._acked
+
+    async def _poll_all(self):
+        self._rx = await self.bus.read(self.rx_ack, 1 + self.slots * self.slot_words)
+        self._acked = bswap32(self._rx[0])
+        return self._rx
+
+    async def _wait_ack(self, seq, window, what, timeout=None):
+        async def poll():
+            return seq_diff(seq, await self._poll_ack()) <= window
+        await self.poller.wait(poll, what, timeout)
+
+    async def clear(self):
+        await self.bus.write(self.tx_ack, [0] * MAILBOX_WORDS)
+        await self.bus.write(self.tx_ack, self._collected)
+
+    async def open(self, timeout=None):
+        """Waits for the N64 to enter ring mode."""
+        expected = (self.base - 1) & SEQ_MASK
+        await self._wait_ack(expected, 0, f"rx_ack={expected:08x}", timeout)
+
+    def in_flight(self):
+        return seq_diff(self._next_seq, (self._acked + 1) & SEQ_MASK)
+
+    def _advance(self):
+        # Commands without a response never occupy their response slot.
+        while self._pending and not self._pending[0][1]:
+            self._collected = self._pending.popleft()[0]
+
+    async def _write_tx_ack(self):
+        if self._tx_acked != self._collected:
+            await self.bus.write(self.tx_ack, self._collected)
+            self._tx_acked = self._collected
+
+    async def submit(self, data: bytes, response=False, timeout=None):
+        """Queues one command and returns its seq.
+
+        Set `response` for commands the N64 answers, and collect() them.
+        """
+        padlen = len(data) % 4
+        if padlen > 0:
+            data += b'\x00' * (4 - padlen)
+        assert(len(data) // 4 <= self.payload_words)
+
+        seq = self._next_seq
+        if seq_diff(seq, self._acked) > self.slots:
+            await self._wait_ack(seq, self.slots, f"a free slot for seq {seq:08x}", timeout)
+
+        self._pending.append((seq, response))
+        self._advance()
+        if response:
+            await self._write_tx_ack()
+
+        slot = self._tx_slot(seq)
+        await self.bus.write(slot + 4, [len(data) // 4] + unpack_uint32_be(data))
+        await self.bus.write(slot, seq)
+
+        self._next_seq = (seq + 1) & SEQ_MASK
+        return seq
+
+    def _find(self, seq: int):
+        if self._rx is None:
+            return None
+        offset = 1 + (seq % self.slots) * self.slot_words
+        if bswap32(self._rx[offset]) != seq:
+            return None
+        length = bswap32(self._rx[offset + 1])
+        assert(length <= self.payload_words)
+        return self._rx[offset + 2:offset + 2 + length]
+
+    async def collect(self, seq: int, timeout=None):
+        """Returns the response payload of command `seq`.
+
+        Responses must be collected in submission order.
+        """
+        assert(self._pending and self._pending[0] == (seq, True))
+
+        async def poll():
+            await self._poll_all()
+            return self._find(seq) is not None
+
+        if self._find(seq) is None:
+            await self.poller.wait(poll, f"response {seq:08x}", timeout)
+        payload = self._find(seq)
+
+        self._pending.popleft()
+        self._collected = seq
+        self._advance()
+        await self._write_tx_ack()
+        return pack_uint32_le(payload)
+
+    async def flush(self, timeout=None):
+        """Waits until the N64 has consumed every submitted command."""
+        last = (self._next_seq - 1) & SEQ_MASK
+        if seq_diff(last, self._acked) > 0:
+            await self._wait_ack(last, 0, f"rx_ack={last:08x}", timeout)
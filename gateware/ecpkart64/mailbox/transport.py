@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+#
+# This file is part of ECPKart64.
+#
+# Copyright (c) 2022 Konrad Beckmann <konrad.beckmann@gmail.com
+# SPDX-License-Identifier: BSD-2-Clause
+
+import struct
+import asyncio
+import inspect
+import functools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from litex.tools.remote.etherbone import EtherbonePacket, EtherboneRecord
+from litex.tools.remote.etherbone import EtherboneReads, EtherboneWrites
+from litex.tools.remote.csr_builder import CSRBuilder
+
+__all__ = ["AsyncRemoteClient", "AsyncBusThread", "BlockingBus", "run_blocking", "blocking_attr"]
+
+# Etherbone packet + record header
+HEADER_LENGTH = 8 + 4
+
+
+class AsyncRemoteClient():
+    """asyncio client for litex_server, with the read/write API of RemoteClient.
+
+    Only mems and constants are loaded from `csr_csv`; CSR registers need
+    blocking access and are not available.
+    """
+
+    def __init__(self, host="localhost", port=1234, csr_csv=None, debug=False):
+        self.host = host
+        self.port = port
+        self.debug = debug
+        if csr_csv is not None:
+            self.items = CSRBuilder.get_csr_items(csr_csv)
+            self.constants = CSRBuilder.build_constants(self)
+            self.mems = CSRBuilder.build_memories(self)
+        self.reader = None
+        self.writer = None
+        self._lock = None
+
+    async def open(self):
+        if self.writer is not None:
+            return
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self._lock = asyncio.Lock()
+
+        # Newer servers announce themselves on connect. Discard the banner.
+        try:
+            await asyncio.wait_for(self.reader.read(128), 0.1)
+        except asyncio.TimeoutError:
+            pass
+
+    async def close(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.reader = None
+        self.writer = None
+
+    async def _send(self, record):
+        packet = EtherbonePacket()
+        packet.records = [record]
+        packet.encode()
+        self.writer.write(packet.bytes)
+        await self.writer.drain()
+
+    async def _receive(self):
+        header = await self.reader.readexactly(HEADER_LENGTH)
+        wcount, rcount = struct.unpack(">BB", header[-2:])
+        length = 0
+        if wcount:
+            length += 4 * wcount + 4
+        if rcount:
+            length += 4 * (rcount + 1)
+        packet = EtherbonePacket(init=header + await self.reader.readexactly(length))
+        packet.decode()
+        return packet.records.pop().writes.get_datas()
+
+    async def read(self, addr, length=None):
+        length_int = 1 if length is None else length
+        record = EtherboneRecord()
+        record.reads = EtherboneReads(addrs=[addr + 4*j for j in range(length_int)])
+        record.rcount = len(record.reads)
+
+        # Responses come back in request order, one request at a time.
+        async with self._lock:
+            await self._send(record)
+            datas = await self._receive()
+
+        if self.debug:
+            for i, data in enumerate(datas):
+                print("read {:08x} @ {:08x}".format(data, addr + 4*i))
+        return datas[0] if length is None else datas
+
+    async def write(self, addr, datas):
+        datas = datas if isinstance(datas, list) else [datas]
+        record = EtherboneRecord()
+        record.writes = EtherboneWrites(base_addr=addr, datas=datas)
+        record.wcount = len(record.writes)
+        await self._send(record)
+
+        if self.debug:
+            for i, data in enumerate(datas):
+                print("write {:08x} @ {:08x}".format(data, addr + 4*i))
+
+
+class AsyncBusThread():
+    """Runs a blocking bus (RemoteClient, CommUART, ...) on its own thread.
+
+    Useful for transports without an asyncio implementation, e.g. a direct
+    UART connection. Accesses are serialized in submission order.
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def __getattr__(self, name):
+        return getattr(self.bus, name)
+
+    async def read(self, addr, length=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.bus.read, addr, length)
+
+    async def write(self, addr, datas):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.bus.write, addr, datas)
+
+
+class BlockingBus():
+    """Presents a blocking bus through the async API without yielding.
+
+    Used by the blocking wrappers, which run on a private event loop.
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+
+    def __getattr__(self, name):
+        return getattr(self.bus, name)
+
+    async def read(self, addr, length=None):
+        return self.bus.read(addr, length)
+
+    async def write(self, addr, datas):
+        self.bus.write(addr, datas)
+
+
+_local = threading.local()
+
+def run_blocking(coro):
+    """Runs `coro` to completion on a private per-thread event loop."""
+    loop = getattr(_local, "loop", None)
+    if loop is None:
+        loop = _local.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coro)
+
+
+def blocking_attr(obj, name):
+    """Returns obj.name, with coroutine methods wrapped to run with run_blocking."""
+    attr = getattr(obj, name)
+    if not inspect.iscoroutinefunction(attr):
+        return attr
+
+    @functools.wraps(attr)
+    def wrapper(*args, **kwargs):
+        return run_blocking(attr(*args, **kwargs))
+    return wrapper
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#
+# This file is part of ECPKart64.
+#
+# Copyright (c) 2022 Konrad Beckmann <konrad.beckmann@gmail.com
+# SPDX-License-Identifier: BSD-2-Clause
+
+import json
+import os
+import platform
+import time
+
+__all__ = ["Benchmark"]
+
+# Stub for the execute benchmark: jr $ra; nop
+RETURN_STUB = bytes.fromhex("03e00008 00000000")
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of a sorted list."""
+    if not samples:
+        return None
+    rank = max(int(round(p / 100 * len(samples))) - 1, 0)
+    return samples[min(rank, len(samples) - 1)]
+
+
+class Benchmark():
+    """Sweeps Commander operations over payload sizes.
+
+    Operations:
+        roundtrip  4 byte peek, the latency of one command and response
+        peek       read `size` bytes
+        poke       write `size` bytes, verified with a checksum afterwards
+        verify     checksum `size` bytes on the N64
+        execute    execute a `jr $ra` stub; only for firmware that calls
+                   the target as a function and returns
+
+    Each case runs for `iterations` operations, or for `duration` seconds
+    if `iterations` is None, at `address` in RDRAM.
+    """
+
+    ops = ["roundtrip", "peek", "poke", "verify", "execute"]
+
+    def __init__(self, commander, mailbox, address=0x8010_0000, duration=1.0, iterations=None):
+        self.commander = commander
+        self.mailbox = mailbox
+        self.address = address
+        self.duration = duration
+        self.iterations = iterations
+
+    def _prepare(self, op, size):
+        """Returns the operation to time and the number of payload bytes it moves."""
+        commander = self.commander
+        address = self.address
+        if op == "roundtrip":
+            return lambda: commander.peek(address, 4), 4
+        if op == "peek":
+            return lambda: commander.peek(address, size), size
+        if op == "poke":
+            data = os.urandom(size)
+            self._data = data
+            return lambda: commander.poke(address, data), size
+        if op == "verify":
+            data = os.urandom(size)
+            commander.poke(address, data)
+            return lambda: commander.checksum(address, size), size
+        if op == "execute":
+            commander.poke(address, RETURN_STUB)
+            return lambda: commander.execute(address), 0
+        raise ValueError(f"Unknown benchmark operation {op}")
+
+    def case(self, op, size):
+        fn, payload = self._prepare(op, size)
+        bus_stats = getattr(self.mailbox.bus, "stats", None)
+
+        self.mailbox.reset_stats()
+        bus_before = bus_stats() if bus_stats else None
+
+        samples = []
+        t0 = time.monotonic()
+        while True:
+            t = time.monotonic()
+            fn()
+            samples.append(time.monotonic() - t)
+            if self.iterations is not None:
+                if len(samples) >= self.iterations:
+                    break
+            elif time.monotonic() - t0 >= self.duration:
+                break
+        elapsed = time.monotonic() - t0
+
+        stats = self.mailbox.stats()
+        samples.sort()
+        moved = stats["poll_words"] + stats["payload_words"]
+        result = dict(
+            op=op,
+            size=payload,
+            iterations=len(samples),
+            elapsed=elapsed,
+            throughput=payload * len(samples) / elapsed if payload else None,
+            ops_per_second=len(samples) / elapsed,
+            latency=dict(
+                mean=sum(samples) / len(samples),
+                min=samples[0],
+                p50=percentile(samples, 50),
+                p99=percentile(samples, 99),
+                max=samples[-1],
+            ),
+            handshake=dict(
+                polls_per_op=stats["polls"] / len(samples),
+                poll_word_ratio=stats["poll_words"] / moved if moved else None,
+                wait_ratio=stats["wait_time"] / elapsed,
+                timeouts=stats["timeouts"],
+            ),
+        )
+        if bus_before is not None:
+            bus_after = bus_stats()
+            result["bus"] = {k: bus_after[k] - bus_before[k] for k in bus_after}
+
+        if op == "poke":
+            result["verified"] = self.commander.verify(self.address, self._data)
+        return result
+
+    def run(self, ops, sizes, progress=None):
+        results = []
+        for op in ops:
+            for size in ([0] if op in ("roundtrip", "execute") else sizes):
+                result = self.case(op, size)
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+        return results
+
+    @staticmethod
+    def failures(results):
+        """Returns the results whose data didn't verify."""
+        return [result for result in results if result.get("verified") is False]
+
+    @staticmethod
+    def format(result):
+        throughput = result["throughput"]
+        latency = result["latency"]
+        line = f"{result['op']:>9} {result['size']:>7} B  {result['iterations']:>6} ops  "
+        line += f"{throughput / 1e3:9.1f} kB/s  " if throughput else f"{'-':>9}       "
+        line += f"p50 {latency['p50'] * 1e3:8.3f} ms  p99 {latency['p99'] * 1e3:8.3f} ms  "
+        line += f"{result['handshake']['polls_per_op']:6.1f} polls/op"
+        if result.get("verified") is False:
+            line += "  VERIFY FAILED"
+        return line
+
+    def dump(self, fp, results, **config):
+        json.dump(dict(
+            config=dict(
+                address=self.address,
+                duration=self.duration,
+                iterations=self.iterations,
+                python=platform.python_version(),
+                time=time.time(),
+                **config),
+            results=results,
+        ), fp, indent=2)
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+#
+# This file is part of ECPKart64.
+#
+# Copyright (c) 2022 Konrad Beckmann <konrad.beckmann@gmail.com
+# SPDX-License-Identifier: BSD-2-Clause
+
+__all__ = ["BulkWindow"]
+
+
+class BulkWindow():
+    """SDRAM staging buffer shared between the host and the N64.
+
+    The N64 sees the window at `n64_base` on the cart bus, the host sees it
+    at `address` (main_ram + `offset`). Both sides store bytes in N64 memory
+    order.
+    """
+
+    def __init__(self, n64_base: int, offset: int, size: int, address: int):
+        self.n64_base = n64_base
+        self.offset = offset
+        self.size = size
+        self.address = address
+
+    @classmethod
+    def from_csr(cls, bus):
+        """Returns the window described by csr.csv, or None if the gateware has none."""
+        constants = bus.constants.d
+        if not constants.get("n64_bulk_size", 0):
+            return None
+        return cls(
+            n64_base=constants["n64_bulk_base"],
+            offset=constants["n64_bulk_offset"],
+            size=constants["n64_bulk_size"],
+            address=bus.mems.main_ram.base + constants["n64_bulk_offset"])
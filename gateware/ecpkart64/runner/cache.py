@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+#
+# This file is part of ECPKart64.
+#
+# Copyright (c) 2022 Konrad Beckmann <konrad.beckmann@gmail.com
+# SPDX-License-Identifier: BSD-2-Clause
+
+import time
+
+from collections import OrderedDict
+
+from .shadow import ADDRESS_MASK
+
+__all__ = ["PageCache"]
+
+# Physical RDRAM, with the Expansion Pak
+RDRAM_BASE = 0x0000_0000
+RDRAM_SIZE = 8 * 1024 * 1024
+
+
+class PageCache():
+    """LRU cache of N64 memory pages for Commander.peek.
+
+    Holds at most `budget` bytes of `page_size` byte pages. Pages older than
+    `max_age` seconds are refetched (None keeps them until evicted or
+    invalidated). When a peek starts where the previous one ended, the next
+    `readahead` pages are fetched along with it.
+    """
+
+    def __init__(self, page_size=1024, budget=1024*1024, max_age=None, readahead=4):
+        assert(page_size % 4 == 0)
+        self.page_size = page_size
+        self.budget = budget
+        self.max_age = max_age
+        self.readahead = readahead
+
+        self.pages = OrderedDict()
+        self._next = None
+
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / lookups if lookups else None,
+            prefetched=self.prefetched,
+            evictions=self.evictions,
+            expired=self.expired,
+            pages=len(self.pages),
+            bytes=len(self.pages) * self.page_size,
+        )
+
+    def span(self, address, length):
+        """Returns the first and last page number covering the range."""
+        address &= ADDRESS_MASK
+        return address // self.page_size, (address + max(length, 1) - 1) // self.page_size
+
+    def get(self, page):
+        entry = self.pages.get(page)
+        if entry is not None and self.max_age is not None and time.monotonic() - entry[0] > self.max_age:
+            del self.pages[page]
+            self.expired += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.pages.move_to_end(page)
+        return entry[1]
+
+    def put(self, page, data, prefetch=False):
+        assert(len(data) == self.page_size)
+        self.pages[page] = (time.monotonic(), bytes(data))
+        self.pages.move_to_end(page)
+        if prefetch:
+            self.prefetched += 1
+        while len(self.pages) * self.page_size > self.budget:
+            self.pages.popitem(last=False)
+            self.evictions += 1
+
+    def readahead_pages(self, last):
+        """Returns the pages to prefetch after page `last`, stopping at the end of RDRAM."""
+        end = (RDRAM_BASE + RDRAM_SIZE) // self.page_size
+        return range(last + 1, min(last + 1 + self.readahead, end))
+
+    def sequential(self, address, length):
+        """Tracks the access pattern, True if this peek continues the previous one."""
+        address &= ADDRESS_MASK
+        sequential = address == self._next
+        self._next = address + length
+        return sequential
+
+    def write(self, address, data):
+        """Applies a write to the cached pages it overlaps."""
+        address &= ADDRESS_MASK
+        first, last = self.span(address, len(data))
+        for page in range(first, last + 1):
+            entry = self.pages.get(page)
+            if entry is None:
+                continue
+            base = page * self.page_size
+            start = max(address, base)
+            end = min(address + len(data), base + self.page_size)
+            patched = bytearray(entry[1])
+            patched[start - base:end - base] = data[start - address:end - address]
+            self.pages[page] = (entry[0], bytes(patched))
+
+    def invalidate(self, address=None, length=None):
+        """Drops the pages overlapping `length` bytes at `address`, or all of them."""
+        if address is None:
+            self.pages.clear()
+            return
+        first, last = self.span(address, length)
+        for page in range(first, last + 1):
+            self.pages.pop(page, None)
@@ -1,13 +1,30 @@
+import asyncio
+import zlib
+
+from collections import deque
+
 from construct import *
 from ..mailbox import *
+from ..util.byteswap import *
+from ..util.compress import *
+from .bulk import *
+from .shadow import *
+from .shadow import ADDRESS_MASK
+from .cache import *
 
-__all__ = ["Commander"]
+__all__ = ["Commander", "AsyncCommander"]
 
 CommandTypeT = Enum(Int32ub,
     COMMAND_INVALID = 0,
     COMMAND_PEEK    = 1,
     COMMAND_POKE    = 2,
     COMMAND_EXECUTE = 3,
+    COMMAND_RING    = 4,
+    COMMAND_BULK_PEEK = 5,
+    COMMAND_BULK_POKE = 6,
+    COMMAND_POKE_COMPRESSED = 7,
+    COMMAND_CHECKSUM = 8,
+    COMMAND_BATCH = 9,
 )
 
 CommandPeekT = Struct(
@@ -27,48 +44,636 @@ CommandExecuteT = Struct(
     "address"             / Hex(Int32ub),
 )
 
+# `data` is a util.compress stream that decodes to `length` bytes at `address`.
+# Matches may refer back to the output of earlier commands of the same poke.
+CommandPokeCompressedT = Struct(
+    "type"                / Const(int(CommandTypeT.COMMAND_POKE_COMPRESSED), Int32ub),
+    "address"             / Hex(Int32ub),
+    "length"              / Hex(Int32ub),
+    "data"                / GreedyBytes,
+)
+
+# CRC32 of `length` bytes at `address`, continuing from `crc` (0 to start).
+# Answered with CommandChecksumResponseT.
+CommandChecksumT = Struct(
+    "type"                / Const(int(CommandTypeT.COMMAND_CHECKSUM), Int32ub),
+    "address"             / Hex(Int32ub),
+    "length"              / Hex(Int32ub),
+    "crc"                 / Hex(Int32ub),
+)
+
+CommandChecksumResponseT = Struct(
+    "crc"                 / Hex(Int32ub),
+)
+
+# `count` BatchOpT descriptors, each POKE followed by its data padded to a
+# word. Answered with the data of every PEEK, each padded to a word.
+CommandBatchT = Struct(
+    "type"                / Const(int(CommandTypeT.COMMAND_BATCH), Int32ub),
+    "count"               / Int32ub,
+    "ops"                 / GreedyBytes,
+)
+
+BatchOpTypeT = Enum(Int32ub,
+    BATCH_PEEK = 1,
+    BATCH_POKE = 2,
+)
+
+BatchOpT = Struct(
+    "op"                  / BatchOpTypeT,
+    "address"             / Hex(Int32ub),
+    "length"              / Hex(Int32ub),
+)
+
+# Switches the N64 over to the MailboxRing protocol
+CommandRingT = Struct(
+    "type"                / Const(int(CommandTypeT.COMMAND_RING), Int32ub),
+    "slots"               / Int32ub,
+    "base"                / Hex(Int32ub),
+)
+
+# Copies RDRAM to the bulk window, answered with an empty payload when done
+CommandBulkPeekT = Struct(
+    "type"                / Const(int(CommandTypeT.COMMAND_BULK_PEEK), Int32ub),
+    "address"             / Hex(Int32ub),
+    "offset"              / Hex(Int32ub),
+    "length"              / Hex(Int32ub),
+)
+
+# Copies the bulk window to RDRAM, answered with an empty payload when done
+CommandBulkPokeT = Struct(
+    "type"                / Const(int(CommandTypeT.COMMAND_BULK_POKE), Int32ub),
+    "address"             / Hex(Int32ub),
+    "offset"              / Hex(Int32ub),
+    "length"              / Hex(Int32ub),
+)
+
 def dbg(*args):
     if False:
     # if True:
         print(*args)
 
-class Commander():
-    def __init__(self, mailbox: Mailbox) -> None:
+class AsyncCommander():
+    """Runs PEEK/POKE/EXECUTE commands over an AsyncMailbox.
+
+    Operations are serialized, so several tasks can share one commander.
+    Each operation takes an optional `timeout` that bounds the whole call
+    and raises MailboxTimeout when it expires. A timed out or cancelled
+    operation leaves the mailbox mid-handshake; re-open it before reuse.
+
+    With a `shadow`, every peek and poke is recorded in it and delta_poke()
+    only sends the pages that changed since. The shadow can't see memory
+    the N64 modifies itself, e.g. after execute(); invalidate() it or use
+    delta_poke(verify=True) then.
+
+    With a `cache` (PageCache), peeks are served from cached pages where
+    possible and pokes update them. As with the shadow, memory modified by
+    the N64 is only noticed after invalidate() or when pages expire.
+    """
+
+    # Transfers of at least this many bytes go through the bulk window
+    bulk_threshold = 1024
+
+    # Words per bus access to the bulk window
+    bulk_chunk_words = 128
+
+    # Pokes of at least this many bytes are sent compressed when it is
+    # cheaper. Off by default, the runner must support COMMAND_POKE_COMPRESSED.
+    compress = False
+    compress_threshold = 256
+
+    # Approximate link cost of one mailbox handshake, in payload bytes
+    handshake_cost = 64
+
+    # Bytes checksummed per command, bounds the time the N64 takes to answer
+    checksum_chunk = 256 * 1024
+
+    def __init__(self, mailbox: AsyncMailbox, bulk: BulkWindow = None, shadow: Shadow = None,
+        cache: PageCache = None) -> None:
         self.mailbox = mailbox
+        self.bus = mailbox.bus
+        self.ring = None
+        self.bulk = bulk
+        self.shadow = shadow
+        self.cache = cache
+        self._lock = None
 
-    def peek(self, address, length):
-        dbg(f"Peek @{address:08x} {length}")
-        chunk_words = 59
-        chunk_bytes = chunk_words * 4
-        full_chunks = length // chunk_bytes
-        remainder = length % chunk_bytes
+    def _locked(self):
+        # Created lazily so it binds to the loop that runs the commander
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
 
-        data = b""
-        for chunk in range(full_chunks):
-            self.mailbox.tx(CommandPeekT.build(dict(
-                address=address + chunk * chunk_bytes,
-                length=chunk_words)))
-            data += self.mailbox.rx()
-        
-        if remainder > 0:
-            self.mailbox.tx(CommandPeekT.build(dict(
-                address=address + full_chunks * chunk_bytes,
-                length=remainder // 4)))
-            data += self.mailbox.rx()
+    async def _run(self, coro, timeout, what):
+        async with self._locked():
+            metrics = self.mailbox.metrics
+            if metrics is None:
+                return await deadline(coro, timeout, what)
 
+            # Whole-operation latency, next to the per-transfer phases
+            t = metrics.start("commander")
+            try:
+                return await deadline(coro, timeout, what)
+            finally:
+                t.mark(what.split(" @")[0])
+
+    async def _write(self, coro, address, data, timeout, what):
+        """Runs a write and keeps the shadow in sync with it."""
+        try:
+            result = await self._run(coro, timeout, what)
+        except BaseException:
+            self.invalidate(address, len(data))
+            raise
+        if self.shadow is not None:
+            self.shadow.update(address, data)
+        if self.cache is not None:
+            self.cache.write(address, data)
+        return result
+
+    def _read(self, address, data):
+        if self.shadow is not None:
+            self.shadow.update(address, data)
         return data
 
-    def poke(self, address, data):
+    def invalidate(self, address=None, length=None):
+        """Drops `length` bytes at `address`, or everything, from the shadow and cache."""
+        if self.shadow is not None:
+            self.shadow.invalidate(address, length)
+        if self.cache is not None:
+            self.cache.invalidate(address, length)
+
+    async def open_ring(self, slots=3, timeout=None):
+        """Switches to pipelined transfers with up to `slots` commands in flight."""
+        if not 1 <= slots <= MAX_SLOTS:
+            raise ValueError(f"A mailbox ring holds 1 to {MAX_SLOTS} slots, not {slots}")
+        await self._run(self._open_ring(slots), timeout, "ring")
+
+    async def _open_ring(self, slots):
+        ring = AsyncMailboxRing(self.bus, self.mailbox.address, slots=slots, poller=self.mailbox.poller)
+        await self.mailbox.release()
+        await self.mailbox.tx(CommandRingT.build(dict(slots=slots, base=ring.base)))
+        # tx_state shares its word with tx_ack, the N64 must see IDLE first
+        await self.mailbox.sync()
+        await ring.clear()
+        await ring.open()
+        self.ring = ring
+
+    async def _call(self, command, words=0):
+        """Sends a command and returns its response."""
+        if self.ring is not None:
+            return await self.ring.collect(await self.ring.submit(command, response=True))
+
+        await self.mailbox.tx(command)
+        return await self.mailbox.rx(words)
+
+    async def _bulk_write(self, offset: int, data: bytes):
+        chunk_bytes = self.bulk_chunk_words * 4
+        for i in range(0, len(data), chunk_bytes):
+            await self.bus.write(self.bulk.address + offset + i, unpack_uint32_le(data[i:i + chunk_bytes]))
+
+    async def _bulk_read_into(self, out, offset: int):
+        chunk_bytes = self.bulk_chunk_words * 4
+        for i in range(0, len(out), chunk_bytes):
+            words = min(chunk_bytes, len(out) - i) // 4
+            out[i:i + words * 4] = pack_uint32_le(await self.bus.read(self.bulk.address + offset + i, words))
+
+    async def bulk_peek(self, address, length, timeout=None):
+        """Reads RDRAM through the bulk window, one handshake per window."""
+        return self._read(address,
+            await self._run(self._bulk_peek(address, length), timeout, f"bulk peek @{address:08x}"))
+
+    async def _bulk_peek(self, address, length):
+        data = bytearray(length & ~3)
+        await self._bulk_peek_into(memoryview(data), address)
+        return bytes(data)
+
+    async def _bulk_peek_into(self, out, address):
+        dbg(f"Bulk peek @{address:08x} {len(out)}")
+        for offset in range(0, len(out), self.bulk.size):
+            chunk = min(self.bulk.size, len(out) - offset)
+            await self._call(CommandBulkPeekT.build(dict(
+                address=address + offset,
+                offset=0,
+                length=chunk)))
+            await self._bulk_read_into(out[offset:offset + chunk], 0)
+
+    async def bulk_poke(self, address, data, timeout=None):
+        """Writes RDRAM through the bulk window, one handshake per window."""
+        await self._write(self._bulk_poke(address, data), address, data, timeout, f"bulk poke @{address:08x}")
+
+    async def _bulk_poke(self, address, data):
+        dbg(f"Bulk poke @{address:08x} {len(data)}")
+        padlen = len(data) % 4
+        if padlen > 0:
+            # Pad a copy, data may be the caller's buffer or a memoryview
+            data = bytes(data) + b'\x00' * (4 - padlen)
+        for offset in range(0, len(data), self.bulk.size):
+            chunk = data[offset:offset + self.bulk.size]
+            await self._bulk_write(0, chunk)
+            await self._call(CommandBulkPokeT.build(dict(
+                address=address + offset,
+                offset=0,
+                length=len(chunk))))
+
+    async def _peek_ring_into(self, out, address):
+        chunk_bytes = self.ring.payload_words * 4
+
+        # (seq, offset, length) of the peeks in flight
+        pending = deque()
+
+        async def collect():
+            seq, offset, length = pending.popleft()
+            out[offset:offset + length] = await self.ring.collect(seq)
+
+        for offset in range(0, len(out), chunk_bytes):
+            if len(pending) == self.ring.slots:
+                await collect()
+            length = min(chunk_bytes, len(out) - offset)
+            seq = await self.ring.submit(CommandPeekT.build(dict(
+                address=address + offset,
+                length=length // 4)), response=True)
+            pending.append((seq, offset, length))
+
+        while pending:
+            await collect()
+
+    async def _poke_ring(self, address, data):
+        # Two words of the slot payload are taken by the command header
+        chunk_bytes = (self.ring.payload_words - 2) * 4
+
+        for offset in range(0, len(data), chunk_bytes):
+            await self.ring.submit(CommandPokeT.build(dict(
+                address=address + offset,
+                data=bytes(data[offset:offset + chunk_bytes]))))
+
+        await self.ring.flush()
+
+    def _payload_words(self):
+        if self.ring is not None:
+            return self.ring.payload_words
+        return MailboxT.rx_payload.sizeof() // 4
+
+    def _poke_cost(self, length):
+        """Link cost of an uncompressed poke of `length` bytes."""
+        if self.bulk is not None and length >= self.bulk_threshold:
+            handshakes = (length + self.bulk.size - 1) // self.bulk.size
+        else:
+            chunk_bytes = (self._payload_words() - 2) * 4
+            handshakes = (length + chunk_bytes - 1) // chunk_bytes
+        return length + handshakes * self.handshake_cost
+
+    def _compress(self, data):
+        """Returns the compressed chunks of `data`, or None if they don't pay off."""
+        # Three words of the payload are taken by the command header
+        budget = (self._payload_words() - 3) * 4
+        if budget < 4:
+            return None
+        chunks = []
+        cost = 0
+        for offset, length, stream in compress_chunks(data, budget):
+            chunks.append((offset, length, stream))
+            cost += len(stream) + self.handshake_cost
+            # Give up early on data that doesn't compress
+            if len(chunks) >= 4 and cost >= self._poke_cost(offset + length):
+                return None
+        if cost >= self._poke_cost(len(data)):
+            return None
+        return chunks
+
+    async def _poke_compressed(self, address, chunks):
+        for offset, length, stream in chunks:
+            command = CommandPokeCompressedT.build(dict(
+                address=address + offset,
+                length=length,
+                data=stream))
+            if self.ring is not None:
+                await self.ring.submit(command)
+            else:
+                await self.mailbox.tx(command)
+
+        if self.ring is not None:
+            await self.ring.flush()
+
+    async def peek(self, address, length, timeout=None):
+        return self._read(address,
+            await self._run(self._peek(address, length), timeout, f"peek @{address:08x}"))
+
+    async def peek_into(self, buf, address, timeout=None):
+        """Reads len(buf) bytes at `address` straight into the writable `buf`.
+
+        Returns the number of bytes read. Without a cache only whole words
+        are read, so a trailing partial word is left untouched.
+        """
+        out = memoryview(buf).cast("B")
+        length = await self._run(self._peek_into(out, address), timeout, f"peek @{address:08x}")
+        self._read(address, out[:length])
+        return length
+
+    async def peek_to(self, fp, address, length, chunk_size=64*1024, timeout=None):
+        """Streams `length` bytes at `address` to `fp` as they arrive.
+
+        Each chunk is a separate operation, `timeout` applies per chunk.
+        Returns the number of bytes written.
+        """
+        buf = memoryview(bytearray(min(chunk_size, length)))
+        written = 0
+        while written < length:
+            n = await self.peek_into(buf[:min(chunk_size, length - written)], address + written, timeout)
+            if n == 0:
+                break
+            fp.write(buf[:n])
+            written += n
+        return written
+
+    async def _peek(self, address, length):
+        data = bytearray(length)
+        length = await self._peek_into(memoryview(data), address)
+        return bytes(data[:length]) if length < len(data) else bytes(data)
+
+    async def _peek_into(self, out, address):
+        if self.cache is not None:
+            return await self._peek_cached_into(out, address)
+        return await self._peek_uncached_into(out, address)
+
+    async def _peek_cached_into(self, out, address):
+        cache = self.cache
+        page_size = cache.page_size
+        segment = address & ~ADDRESS_MASK
+        length = len(out)
+        first, last = cache.span(address, length)
+        readahead = cache.readahead if cache.sequential(address, length) else 0
+
+        pages = {}
+        missing = []
+        for page in range(first, last + 1):
+            data = cache.get(page)
+            if data is None:
+                missing.append(page)
+            else:
+                pages[page] = data
+        if missing and readahead:
+            missing += [page for page in cache.readahead_pages(last) if page not in cache.pages]
+
+        # Fetch runs of consecutive missing pages with one peek each
+        while missing:
+            run = 1
+            while run < len(missing) and missing[run] == missing[0] + run:
+                run += 1
+            data = memoryview(bytearray(run * page_size))
+            await self._peek_uncached_into(data, segment | (missing[0] * page_size))
+            for i, page in enumerate(missing[:run]):
+                pages[page] = data[i * page_size:(i + 1) * page_size]
+                cache.put(page, pages[page], prefetch=page > last)
+            missing = missing[run:]
+
+        base = first * page_size - (address & ADDRESS_MASK)
+        for page in range(first, last + 1):
+            start = base + (page - first) * page_size
+            lo = max(start, 0)
+            hi = min(start + page_size, length)
+            out[lo:hi] = pages[page][lo - start:hi - start]
+        return length
+
+    async def _peek_uncached_into(self, out, address):
+        length = len(out) & ~3
+        dbg(f"Peek @{address:08x} {length}")
+        if self.bulk is not None and length >= self.bulk_threshold:
+            await self._bulk_peek_into(out[:length], address)
+            return length
+        if self.ring is not None:
+            await self._peek_ring_into(out[:length], address)
+            return length
+
+        chunk_bytes = 59 * 4
+        for offset in range(0, length, chunk_bytes):
+            n = min(chunk_bytes, length - offset)
+            await self.mailbox.tx(CommandPeekT.build(dict(
+                address=address + offset,
+                length=n // 4)))
+            out[offset:offset + n] = await self.mailbox.rx(n // 4)
+
+        return length
+
+    async def poke(self, address, data, timeout=None):
+        await self._write(self._poke(address, data), address, data, timeout, f"poke @{address:08x}")
+
+    async def _poke(self, address, data):
         dbg(f"Poke @{address:08x}={data}")
+        if self.compress and len(data) >= self.compress_threshold:
+            chunks = self._compress(data)
+            if chunks is not None:
+                return await self._poke_compressed(address, chunks)
+        if self.bulk is not None and len(data) >= self.bulk_threshold:
+            return await self._bulk_poke(address, data)
+        if self.ring is not None:
+            return await self._poke_ring(address, data)
 
         chunk_words = 59
         chunk_bytes = chunk_words * 4
         chunks = (len(data) + chunk_bytes - 1) // chunk_bytes
 
         for chunk in range(chunks):
-            self.mailbox.tx(CommandPokeT.build(dict(
+            await self.mailbox.tx(CommandPokeT.build(dict(
                 address=address + chunk * chunk_bytes,
-                data=data[chunk * chunk_bytes:(chunk + 1) * chunk_bytes])))
+                data=bytes(data[chunk * chunk_bytes:(chunk + 1) * chunk_bytes]))))
+
+    async def delta_poke(self, address, data, verify=False, timeout=None):
+        """Pokes the pages of `data` that differ from the shadow.
+
+        With `verify`, the ranges the shadow considers unchanged are
+        checksummed on the N64, one round trip each, and resent if the N64
+        has modified them. Returns the number of bytes sent.
+        """
+        if self.shadow is None:
+            raise ValueError("delta_poke() needs a Commander with a shadow")
+        return await self._write(self._delta_poke(address, data, verify), address, data, timeout,
+            f"delta poke @{address:08x}")
+
+    async def _delta_poke(self, address, data, verify):
+        changed = self.shadow.diff(address, data)
+
+        if verify:
+            start = 0
+            for offset, length in changed + [(len(data), 0)]:
+                if offset > start:
+                    changed += await self._stale(address, data, start, offset)
+                start = offset + length
+            changed.sort()
+
+        sent = 0
+        for offset, length in changed:
+            await self._poke(address + offset, data[offset:offset + length])
+            sent += length
+        return sent
+
+    async def _stale(self, address, data, start, end):
+        """Returns the ranges in data[start:end] that the N64 doesn't hold.
+
+        Mismatching ranges are bisected down to the shadow page size.
+        """
+        crc = await self._checksum(address + start, end - start)
+        if crc == zlib.crc32(data[start:end]):
+            return []
+        if end - start <= self.shadow.page_size:
+            return [(start, end - start)]
+        middle = (start + end) // 2
+        return (await self._stale(address, data, start, middle) +
+                await self._stale(address, data, middle, end))
+
+    async def checksum(self, address, length, timeout=None):
+        """Returns the CRC32 of `length` bytes of N64 memory, computed on the N64."""
+        return await self._run(self._checksum(address, length), timeout, f"checksum @{address:08x}")
+
+    async def _checksum(self, address, length):
+        crc = 0
+        for offset in range(0, length, self.checksum_chunk):
+            response = await self._call(CommandChecksumT.build(dict(
+                address=address + offset,
+                length=min(self.checksum_chunk, length - offset),
+                crc=crc)), 1)
+            crc = CommandChecksumResponseT.parse(response).crc
+        return crc
+
+    def _batches(self, items):
+        """Splits (op, address, length, data) items into batches that fit a payload.
+
+        Yields (count, ops, response_words, pieces), where pieces lists the
+        item index and length of every PEEK result in the response.
+        """
+        capacity = self._payload_words() * 4
+        # Two words are taken by the batch header
+        request_capacity = capacity - 8
+
+        ops, count, response, pieces = bytearray(), 0, 0, []
+        for index, (op, address, length, data) in enumerate(items):
+            offset = 0
+            while offset < length:
+                header_room = request_capacity - len(ops) - BatchOpT.sizeof()
+                if op == "BATCH_PEEK":
+                    room = min(capacity - response, length - offset) if header_room >= 0 else 0
+                else:
+                    room = min(header_room & ~3, length - offset)
+                if room <= 0:
+                    if not count:
+                        raise ValueError(f"A {op} op doesn't fit in a {capacity} byte payload")
+                    yield count, bytes(ops), response // 4, pieces
+                    ops, count, response, pieces = bytearray(), 0, 0, []
+                    continue
+
+                ops += BatchOpT.build(dict(op=op, address=address + offset, length=room))
+                if op == "BATCH_PEEK":
+                    response += (room + 3) & ~3
+                    pieces.append((index, room))
+                else:
+                    ops += bytes(data[offset:offset + room]) + b"\x00" * (-room % 4)
+                count += 1
+                offset += room
+
+        if count:
+            yield count, bytes(ops), response // 4, pieces
+
+    async def _batch(self, items):
+        results = [bytearray() for _ in items]
+        for count, ops, response_words, pieces in self._batches(items):
+            response = await self._call(CommandBatchT.build(dict(count=count, ops=ops)), response_words)
+            offset = 0
+            for index, length in pieces:
+                results[index] += response[offset:offset + length]
+                offset += (length + 3) & ~3
+        return results
+
+    async def peek_many(self, ranges, timeout=None):
+        """Reads a list of (address, length) ranges, packing many per round trip.
+
+        Returns a list with the data of each range.
+        """
+        ranges = list(ranges)
+        results = await self._run(self._batch([("BATCH_PEEK", address, length, None) for address, length in ranges]),
+            timeout, "peek_many")
+        return [self._read(address, bytes(data)) for (address, _), data in zip(ranges, results)]
+
+    async def poke_many(self, writes, timeout=None):
+        """Writes a list of (address, data) pairs, packing many per round trip."""
+        writes = list(writes)
+        try:
+            await self._run(self._batch([("BATCH_POKE", address, len(data), data) for address, data in writes]),
+                timeout, "poke_many")
+        except BaseException:
+            for address, data in writes:
+                self.invalidate(address, len(data))
+            raise
+        for address, data in writes:
+            if self.shadow is not None:
+                self.shadow.update(address, data)
+            if self.cache is not None:
+                self.cache.write(address, data)
+
+    async def verify(self, address, data, timeout=None):
+        """Returns True if N64 memory at `address` holds `data`.
+
+        Costs one round trip per checksum_chunk instead of reading it back.
+        """
+        crc = await self.checksum(address, len(data), timeout)
+        return crc == zlib.crc32(data)
+
+    async def execute(self, address, timeout=None):
+        await self._run(self._execute(address), timeout, f"execute @{address:08x}")
+
+    async def _execute(self, address):
+        if self.ring is not None:
+            await self.ring.submit(CommandExecuteT.build(dict(address=address)))
+            await self.ring.flush()
+            return
+
+        await self.mailbox.tx(CommandExecuteT.build(dict(address=address)))
+
+
+class Commander():
+    """Blocking wrapper around AsyncCommander."""
+
+    def __init__(self, mailbox: Mailbox, bulk: BulkWindow = None, shadow: Shadow = None,
+        cache: PageCache = None) -> None:
+        self.mailbox = mailbox
+        self.async_commander = AsyncCommander(mailbox.async_mailbox, bulk=bulk, shadow=shadow, cache=cache)
+
+    def __getattr__(self, name):
+        return blocking_attr(self.async_commander, name)
+
+    def open_ring(self, slots=3, timeout=None):
+        run_blocking(self.async_commander.open_ring(slots, timeout))
+
+    def bulk_peek(self, address, length, timeout=None):
+        return run_blocking(self.async_commander.bulk_peek(address, length, timeout))
+
+    def bulk_poke(self, address, data, timeout=None):
+        run_blocking(self.async_commander.bulk_poke(address, data, timeout))
+
+    def peek(self, address, length, timeout=None):
+        return run_blocking(self.async_commander.peek(address, length, timeout))
+
+    def peek_into(self, buf, address, timeout=None):
+        return run_blocking(self.async_commander.peek_into(buf, address, timeout))
+
+    def peek_to(self, fp, address, length, chunk_size=64*1024, timeout=None):
+        return run_blocking(self.async_commander.peek_to(fp, address, length, chunk_size, timeout))
+
+    def poke(self, address, data, timeout=None):
+        run_blocking(self.async_commander.poke(address, data, timeout))
+
+    def delta_poke(self, address, data, verify=False, timeout=None):
+        return run_blocking(self.async_commander.delta_poke(address, data, verify, timeout))
+
+    def peek_many(self, ranges, timeout=None):
+        return run_blocking(self.async_commander.peek_many(ranges, timeout))
+
+    def poke_many(self, writes, timeout=None):
+        run_blocking(self.async_commander.poke_many(writes, timeout))
+
+    def checksum(self, address, length, timeout=None):
+        return run_blocking(self.async_commander.checksum(address, length, timeout))
+
+    def verify(self, address, data, timeout=None):
+        return run_blocking(self.async_commander.verify(address, data, timeout))
 
-    def execute(self, address):
-        self.mailbox.tx(CommandExecuteT.build(dict(address=address)))
+    def execute(self, address, timeout=None):
+        run_blocking(self.async_commander.execute(address, timeout))
@@ -6,6 +6,7 @@
 # SPDX-License-Identifier: BSD-2-Clause
 
 import os
+import sys
 import argparse
 import time
 
@@ -13,6 +14,9 @@ from litex import RemoteClient
 
 from ..mailbox import *
 from .commander import *
+from .bulk import *
+from .sim import *
+from .benchmark import *
 
 
 def dbg(*args):
@@ -21,17 +25,30 @@ def dbg(*args):
 
 
 class Runner():
-    def __init__(self, csr_csv="csr.csv", address=0x8000_0000):
+    def __init__(self, csr_csv="csr.csv", address=0x8000_0000, burst=False, timeout=1.0, ring_slots=0, bulk=False,
+                 metrics=False, bus=None, compress=False):
         self.csr_csv = csr_csv
         self.address = address
 
-        self.bus = RemoteClient(csr_csv=csr_csv)
+        if bus is None:
+            bus = RemoteClient(csr_csv=csr_csv)
+        self.bus = bus
         self.bus.open()
 
-        mailbox = Mailbox(self.bus, self.address)
+        mailbox = Mailbox(self.bus, self.address, burst=burst, timeout=timeout, metrics=metrics)
         mailbox.open()
 
-        self.commander = Commander(mailbox)
+        bulk_window = None
+        if bulk:
+            bulk_window = BulkWindow.from_csr(self.bus)
+            if bulk_window is None:
+                raise ValueError("The gateware has no bulk window. Build it with --bulk-size.")
+
+        self.mailbox = mailbox
+        self.commander = Commander(mailbox, bulk=bulk_window)
+        self.commander.async_commander.compress = compress
+        if ring_slots > 0:
+            self.commander.open_ring(ring_slots)
 
     def reboot(self):
         self.commander.execute(0x80000400)
@@ -43,21 +60,56 @@ def parse_args():
     parser.add_argument("--address", default=0x8000_0000, type=lambda x: int(x, 0))
     parser.add_argument("--reset", default=False, action='store_true')
     parser.add_argument("--reboot", default=False, action='store_true')
-    parser.add_argument("--benchmark", default=False, action='store_true')
+    parser.add_argument("--benchmark", default=False, action='store_true', help="Benchmark the Commander operations")
+    parser.add_argument("--bench-ops", default="roundtrip,peek,poke,verify", help="Operations to benchmark: " + ",".join(Benchmark.ops))
+    parser.add_argument("--bench-sizes", default="4,64,236,1024,4096,16384", help="Payload sizes in bytes")
+    parser.add_argument("--bench-duration", default=1.0, type=float, help="Seconds per benchmark case")
+    parser.add_argument("--bench-iterations", default=None, type=int, help="Operations per benchmark case, instead of a duration")
+    parser.add_argument("--bench-address", default=0x8010_0000, type=lambda x: int(x, 0), help="RDRAM scratch area for the benchmark")
+    parser.add_argument("--bench-json", default=None, help="Write the benchmark results as JSON to this file")
+    parser.add_argument("--burst", default=False, action='store_true', help="Use burst mailbox transactions")
+    parser.add_argument("--timeout", default=1.0, type=float, help="Mailbox handshake timeout in seconds")
+    parser.add_argument("--ring", default=0, type=int, help="Pipeline commands over a ring of this many mailbox slots")
+    parser.add_argument("--bulk", default=False, action='store_true', help="Move large transfers through the SDRAM bulk window")
+    parser.add_argument("--compress", default=False, action='store_true', help="Send large pokes compressed, needs a runner with COMMAND_POKE_COMPRESSED")
+    parser.add_argument("--metrics", default=None, help="Record mailbox phase latencies and write them as JSON to this file")
+    parser.add_argument("--sim", default=False, action='store_true', help="Run against a simulated cart and N64 instead of litex_server")
+    parser.add_argument("--sim-latency", default=0.0, type=float, help="Simulated link latency per access in seconds")
+    parser.add_argument("--sim-bandwidth", default=None, type=float, help="Simulated link bandwidth in bytes/s")
+    parser.add_argument("--sim-bulk-size", default=0, type=lambda x: int(x, 0), help="Simulated bulk window size")
     args = parser.parse_args()
+    if args.ring and not 1 <= args.ring <= MAX_SLOTS:
+        parser.error(f"--ring must be between 1 and {MAX_SLOTS} slots")
     return args
 
 
 def main():
     args = parse_args()
 
+    bus = None
+    if args.sim:
+        bus = SimBus(mailbox_address=args.address, latency=args.sim_latency, bandwidth=args.sim_bandwidth,
+                     bulk_size=args.sim_bulk_size)
+        SimN64(bus).start()
+
     # Create and open remote control.
-    if not os.path.exists(args.csr_csv):
+    elif not os.path.exists(args.csr_csv):
         raise ValueError("{} not found. This is necessary to load the 'regs' of the remote. Try setting --csr-csv here to "
                          "the path to the --csr-csv argument of the SoC build.".format(args.csr_csv))
 
-    runner = Runner(args.csr_csv, address=args.address)
+    runner = Runner(args.csr_csv, address=args.address, burst=args.burst, timeout=args.timeout,
+                    ring_slots=args.ring, bulk=args.bulk, metrics=args.metrics is not None, bus=bus,
+                    compress=args.compress)
+
+    try:
+        run(runner, args)
+    finally:
+        if args.metrics is not None:
+            with open(args.metrics, "w") as f:
+                runner.mailbox.dump_metrics(f)
+
 
+def run(runner, args):
     if args.reset:
         return
 
@@ -65,17 +117,21 @@ def main():
         runner.reboot()
 
     if args.benchmark:
-        total = 0
-        t0 = time.monotonic()
-        while True:
-            length = 4 * 59 * 10
-            total += length
-            facit = os.urandom(length)
-            runner.commander.poke(0x80100000, facit)
-            data = runner.commander.peek(0x80100000, len(facit))
-            assert(data == facit)
-            print("ok")
-            # print(f"ok: {total / (time.monotonic() - t0):.00f} bytes/s")
+        benchmark = Benchmark(runner.commander, runner.mailbox, address=args.bench_address,
+                              duration=args.bench_duration, iterations=args.bench_iterations)
+        results = benchmark.run(
+            ops=args.bench_ops.split(","),
+            sizes=[int(size, 0) for size in args.bench_sizes.split(",")],
+            progress=lambda result: print(Benchmark.format(result)))
+
+        if args.bench_json is not None:
+            with open(args.bench_json, "w") as f:
+                benchmark.dump(f, results, burst=args.burst, ring=args.ring, bulk=args.bulk, compress=args.compress,
+                               sim=args.sim, sim_latency=args.sim_latency, sim_bandwidth=args.sim_bandwidth)
+
+        failed = Benchmark.failures(results)
+        if failed:
+            sys.exit("Verify failed for: " + ", ".join(f"{result['op']} {result['size']} B" for result in failed))
 
 
 if __name__ == "__main__":
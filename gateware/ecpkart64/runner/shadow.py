@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+#
+# This file is part of ECPKart64.
+#
+# Copyright (c) 2022 Konrad Beckmann <konrad.beckmann@gmail.com
+# SPDX-License-Identifier: BSD-2-Clause
+
+import hashlib
+
+__all__ = ["Shadow"]
+
+# KSEG0/KSEG1 addresses alias the same physical memory
+ADDRESS_MASK = 0x1fff_ffff
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class Shadow():
+    """Per-page hashes of N64 memory as last written or read by the host.
+
+    Each page of `page_size` bytes remembers the byte range within the page
+    that is known, and a hash of its contents. A write that only partly
+    overlaps a known range replaces it, so the shadow never claims more
+    than it has seen.
+    """
+
+    def __init__(self, page_size=4096):
+        self.page_size = page_size
+        self.pages = {}
+
+    def _slices(self, address, length):
+        """Yields (page, start, offset, length) for each page touched."""
+        address &= ADDRESS_MASK
+        offset = 0
+        while offset < length:
+            page, start = divmod(address + offset, self.page_size)
+            n = min(self.page_size - start, length - offset)
+            yield page, start, offset, n
+            offset += n
+
+    def update(self, address, data):
+        """Records that N64 memory at `address` now holds `data`."""
+        data = memoryview(data)
+        for page, start, offset, n in self._slices(address, len(data)):
+            self.pages[page] = (start, n, _digest(data[offset:offset + n]))
+
+    def diff(self, address, data):
+        """Returns the (offset, length) ranges of `data` that may differ.
+
+        Adjacent changed pages are merged into one range.
+        """
+        data = memoryview(data)
+        ranges = []
+        for page, start, offset, n in self._slices(address, len(data)):
+            entry = self.pages.get(page)
+            if entry is not None and entry == (start, n, _digest(data[offset:offset + n])):
+                continue
+            if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + n)
+            else:
+                ranges.append((offset, n))
+        return ranges
+
+    def invalidate(self, address=None, length=None):
+        """Forgets `length` bytes at `address`, or everything."""
+        if address is None:
+            self.pages.clear()
+            return
+        for page, _, _, _ in self._slices(address, length):
+            self.pages.pop(page, None)
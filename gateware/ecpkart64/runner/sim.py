@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+#
+# This file is part of ECPKart64.
+#
+# Copyright (c) 2022 Konrad Beckmann <konrad.beckmann@gmail.com
+# SPDX-License-Identifier: BSD-2-Clause
+
+import struct
+import threading
+import time
+import zlib
+
+from litex.tools.remote.csr_builder import CSRElements, CSRMemoryRegion
+
+from ..cart import BULK_WINDOW_BASE
+from ..mailbox.types import *
+from ..mailbox.ring import seq_diff
+from ..util.byteswap import *
+from ..util.compress import decompress_into
+from .commander import (CommandTypeT, CommandPeekT, CommandPokeT, CommandExecuteT, CommandRingT,
+    CommandBulkPeekT, CommandBulkPokeT, CommandPokeCompressedT, CommandChecksumT, CommandChecksumResponseT,
+    CommandBatchT, BatchOpT)
+
+__all__ = ["SimBus", "SimN64"]
+
+IDLE = int(MailboxStateT.MAILBOX_STATUS_IDLE)
+BUSY = int(MailboxStateT.MAILBOX_STATUS_BUSY)
+DONE = int(MailboxStateT.MAILBOX_STATUS_DONE)
+
+MAILBOX_WORDS = 64
+
+# Word offsets in each mailbox RAM
+STATE      = 0
+STATE_RECV = 1
+LENGTH     = 2
+PAYLOAD    = 3
+
+def dbg(*args):
+    if False:
+    # if True:
+        print(*args)
+
+
+class SimBus():
+    """Stand-in for RemoteClient, backed by a memory model of the SoC.
+
+    Models mailbox_ram_r, mailbox_ram_w and main_ram (SDRAM) at the
+    addresses used by the kilsyth target. Every other address reads back
+    what was last written to it.
+
+    Each access is delayed by `latency` seconds plus the time it takes to
+    move the data words at `bandwidth` bytes/s (None for unlimited), which
+    approximates a UART or Etherbone link to litex_server.
+
+    `bulk_size` > 0 exports the same n64_bulk_* constants as a gateware
+    built with --bulk-size, so BulkWindow.from_csr() works on it.
+    """
+
+    def __init__(self, mailbox_address=0x8000_0000, main_ram_base=0x4000_0000,
+        main_ram_size=32*1024*1024, latency=0.0, bandwidth=None, bulk_size=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+        self.mailbox_r_base = mailbox_address
+        self.mailbox_w_base = mailbox_address + MAILBOX_WORDS * 4
+        self.mailbox_r = [0] * MAILBOX_WORDS
+        self.mailbox_w = [0] * MAILBOX_WORDS
+
+        self.main_ram_base = main_ram_base
+        self.main_ram = bytearray(main_ram_size)
+        self.other = {}
+
+        constants = dict(config_csr_data_width=32)
+        if bulk_size > 0:
+            constants.update(
+                n64_bulk_base=BULK_WINDOW_BASE,
+                n64_bulk_offset=main_ram_size - bulk_size,
+                n64_bulk_size=bulk_size)
+        self.constants = CSRElements(constants)
+        self.mems = CSRElements(dict(
+            mailbox_ram_r=CSRMemoryRegion(self.mailbox_r_base, MAILBOX_WORDS * 4, "io"),
+            mailbox_ram_w=CSRMemoryRegion(self.mailbox_w_base, MAILBOX_WORDS * 4, "io"),
+            main_ram=CSRMemoryRegion(main_ram_base, main_ram_size, "cached"),
+        ))
+        self.regs = CSRElements({})
+
+        # Notified whenever the host writes, the N64 waits on it
+        self.changed = threading.Condition()
+
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.reads = 0
+        self.writes = 0
+        self.words_read = 0
+        self.words_written = 0
+        self.link_time = 0.0
+
+    def stats(self):
+        return dict(
+            reads=self.reads,
+            writes=self.writes,
+            words_read=self.words_read,
+            words_written=self.words_written,
+            link_time=self.link_time,
+        )
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _delay(self, words):
+        delay = self.latency
+        if self.bandwidth:
+            delay += words * 4 / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+            self.link_time += delay
+
+    def _read_word(self, addr):
+        if self.mailbox_r_base <= addr < self.mailbox_r_base + MAILBOX_WORDS * 4:
+            return self.mailbox_r[(addr - self.mailbox_r_base) // 4]
+        if self.mailbox_w_base <= addr < self.mailbox_w_base + MAILBOX_WORDS * 4:
+            return self.mailbox_w[(addr - self.mailbox_w_base) // 4]
+        if self.main_ram_base <= addr < self.main_ram_base + len(self.main_ram):
+            return struct.unpack_from("<I", self.main_ram, addr - self.main_ram_base)[0]
+        return self.other.get(addr, 0)
+
+    def _write_word(self, addr, data):
+        data &= 0xffff_ffff
+        if self.mailbox_w_base <= addr < self.mailbox_w_base + MAILBOX_WORDS * 4:
+            self.mailbox_w[(addr - self.mailbox_w_base) // 4] = data
+        elif self.mailbox_r_base <= addr < self.mailbox_r_base + MAILBOX_WORDS * 4:
+            # Read only from the SoC side
+            pass
+        elif self.main_ram_base <= addr < self.main_ram_base + len(self.main_ram):
+            struct.pack_into("<I", self.main_ram, addr - self.main_ram_base, data)
+        else:
+            self.other[addr] = data
+
+    def read(self, addr, length=None, burst="incr"):
+        length_int = 1 if length is None else length
+        self._delay(length_int)
+        offset = addr - self.main_ram_base
+        with self.changed:
+            if burst == "fixed":
+                datas = [self._read_word(addr)] * length_int
+            elif 0 <= offset <= len(self.main_ram) - 4 * length_int:
+                datas = unpack_uint32_le(self.main_ram[offset:offset + 4 * length_int])
+            else:
+                datas = [self._read_word(addr + 4*i) for i in range(length_int)]
+        self.reads += 1
+        self.words_read += length_int
+        return datas[0] if length is None else datas
+
+    def write(self, addr, datas):
+        datas = datas if isinstance(datas, list) else [datas]
+        self._delay(len(datas))
+        with self.changed:
+            for i, data in enumerate(datas):
+                self._write_word(addr + 4*i, data)
+            self.changed.notify_all()
+        self.writes += 1
+        self.words_written += len(datas)
+
+
+class SimStopped(Exception):
+    pass
+
+
+class SimN64(threading.Thread):
+    """Simulated N64 running the mailbox command loop.
+
+    Implements the N64 side of the mailbox handshake, the MailboxRing
+    protocol and the PEEK, POKE, POKE_COMPRESSED, CHECKSUM, BATCH, EXECUTE,
+    BULK_PEEK and BULK_POKE commands against a simulated RDRAM of
+    `rdram_size` bytes. Addresses are mapped like KSEG0/KSEG1, i.e. only the
+    low 29 bits are used.
+
+    The N64 sees mailbox_ram_w as written by the host, and its writes to
+    mailbox_ram_r are byte swapped on the way, like on the real cart bus.
+    `command_latency` adds a fixed processing time to every command.
+
+    EXECUTE only records the address in `executed`. An invalid command or
+    address stops the thread and is kept in `error`; the host then sees a
+    mailbox timeout.
+    """
+
+    def __init__(self, bus: SimBus, rdram_size=8*1024*1024, command_latency=0.0):
+        super().__init__(name="SimN64", daemon=True)
+        self.bus = bus
+        self.rdram = bytearray(rdram_size)
+        self.command_latency = command_latency
+        self.executed = []
+        self.commands = 0
+        self.error = None
+        self._stop_event = threading.Event()
+
+        constants = bus.constants.d
+        self.bulk_offset = constants.get("n64_bulk_offset", 0)
+        self.bulk_size = constants.get("n64_bulk_size", 0)
+
+    def stop(self):
+        self._stop_event.set()
+        with self.bus.changed:
+            self.bus.changed.notify_all()
+        self.join()
+
+    # Mailbox access from the N64 side
+
+    def _read(self, offset):
+        return self.bus.mailbox_w[offset]
+
+    def _write(self, offset, value):
+        with self.bus.changed:
+            self.bus.mailbox_r[offset] = bswap32(value)
+
+    def _read_payload(self, offset, length):
+        with self.bus.changed:
+            return pack_uint32_be(self.bus.mailbox_w[offset:offset + length])
+
+    def _write_payload(self, offset, data):
+        words = unpack_uint32_le(data)
+        with self.bus.changed:
+            self.bus.mailbox_r[offset:offset + len(words)] = words
+
+    def _wait(self, condition):
+        with self.bus.changed:
+            while not condition():
+                if self._stop_event.is_set():
+                    raise SimStopped()
+                self.bus.changed.wait(0.1)
+
+    # Regular handshake
+
+    def recv(self):
+        self._wait(lambda: self._read(STATE) == DONE)
+        self._write(STATE_RECV, BUSY)
+        length = self._read(LENGTH)
+        assert(length <= MAILBOX_WORDS - PAYLOAD)
+        data = self._read_payload(PAYLOAD, length)
+        self._write(STATE_RECV, DONE)
+        self._wait(lambda: self._read(STATE) == IDLE)
+        self._write(STATE_RECV, IDLE)
+        return data
+
+    def send(self, data: bytes):
+        self._wait(lambda: self._read(STATE_RECV) == IDLE)
+        self._write(STATE, BUSY)
+        self._write_payload(PAYLOAD, data)
+        self._write(LENGTH, len(data) // 4)
+        self._write(STATE, DONE)
+        self._wait(lambda: self._read(STATE_RECV) == DONE)
+        self._write(STATE, IDLE)
+
+    # MailboxRing protocol
+
+    def ring(self, slots: int, base: int):
+        slot_words = (MAILBOX_WORDS - 1) // slots
+        for n in range(slots):
+            self._write(1 + n * slot_words, 0)
+        self._write(0, (base - 1) & 0xffff_ffff)
+
+        seq = base
+        while True:
+            slot = 1 + (seq % slots) * slot_words
+            self._wait(lambda: self._read(slot) == seq)
+            data = self._read_payload(slot + 2, self._read(slot + 1))
+            self._write(0, seq)
+
+            def send(response, seq=seq, slot=slot):
+                # The host frees response slots by advancing tx_ack
+                self._wait(lambda: seq_diff(self._read(0), seq - slots) >= 0)
+                self._write_payload(slot + 2, response)
+                self._write(slot + 1, len(response) // 4)
+                self._write(slot, seq)
+
+            self.handle(data, send)
+            seq = (seq + 1) & 0xffff_ffff
+
+    # Commands
+
+    def _rdram(self, address, length):
+        address &= 0x1fff_ffff
+        if address + length > len(self.rdram):
+            raise ValueError(f"RDRAM access out of range: {address:08x}+{length}")
+        return address
+
+    def _bulk(self, offset, length):
+        if offset + length > self.bulk_size:
+            raise ValueError(f"Bulk window access out of range: {offset:08x}+{length}")
+        return self.bulk_offset + offset
+
+    def handle(self, data: bytes, send):
+        command = CommandTypeT.parse(data)
+        dbg(f"SimN64: {command}")
+        self.commands += 1
+        if self.command_latency > 0:
+            time.sleep(self.command_latency)
+
+        if command == "COMMAND_PEEK":
+            cmd = CommandPeekT.parse(data)
+            address = self._rdram(cmd.address, cmd.length * 4)
+            send(bytes(self.rdram[address:address + cmd.length * 4]))
+        elif command == "COMMAND_POKE":
+            cmd = CommandPokeT.parse(data)
+            address = self._rdram(cmd.address, len(cmd.data))
+            self.rdram[address:address + len(cmd.data)] = cmd.data
+        elif command == "COMMAND_POKE_COMPRESSED":
+            cmd = CommandPokeCompressedT.parse(data)
+            address = self._rdram(cmd.address, cmd.length)
+            decompress_into(self.rdram, address, cmd.data, cmd.length)
+        elif command == "COMMAND_CHECKSUM":
+            cmd = CommandChecksumT.parse(data)
+            address = self._rdram(cmd.address, cmd.length)
+            crc = zlib.crc32(self.rdram[address:address + cmd.length], cmd.crc)
+            send(CommandChecksumResponseT.build(dict(crc=crc)))
+        elif command == "COMMAND_BATCH":
+            cmd = CommandBatchT.parse(data)
+            response = bytearray()
+            offset = 0
+            for i in range(cmd.count):
+                op = BatchOpT.parse(cmd.ops[offset:])
+                offset += BatchOpT.sizeof()
+                address = self._rdram(op.address, op.length)
+                if op.op == "BATCH_PEEK":
+                    response += self.rdram[address:address + op.length] + b"\x00" * (-op.length % 4)
+                else:
+                    self.rdram[address:address + op.length] = cmd.ops[offset:offset + op.length]
+                    offset += (op.length + 3) & ~3
+            send(bytes(response))
+        elif command == "COMMAND_EXECUTE":
+            self.executed.append(CommandExecuteT.parse(data).address)
+        elif command == "COMMAND_BULK_PEEK":
+            cmd = CommandBulkPeekT.parse(data)
+            address = self._rdram(cmd.address, cmd.length)
+            offset = self._bulk(cmd.offset, cmd.length)
+            self.bus.main_ram[offset:offset + cmd.length] = self.rdram[address:address + cmd.length]
+            send(b"")
+        elif command == "COMMAND_BULK_POKE":
+            cmd = CommandBulkPokeT.parse(data)
+            address = self._rdram(cmd.address, cmd.length)
+            offset = self._bulk(cmd.offset, cmd.length)
+            self.rdram[address:address + cmd.length] = self.bus.main_ram[offset:offset + cmd.length]
+            send(b"")
+        else:
+            raise ValueError(f"Unsupported command {command}")
+
+    def run(self):
+        try:
+            while True:
+                data = self.recv()
+                if CommandTypeT.parse(data) == "COMMAND_RING":
+                    cmd = CommandRingT.parse(data)
+                    self.ring(cmd.slots, cmd.base)
+                else:
+                    self.handle(data, self.send)
+        except SimStopped:
+            pass
+        except Exception as e:
+            self.error = e
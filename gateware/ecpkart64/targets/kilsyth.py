@@ -36,7 +36,7 @@ from litedram.modules import SDRAMModule, _TechnologyTimings, _SpeedgradeTimings
 
 from ..platforms import kilsyth
 
-from ..cart import N64Cart
+from ..cart import N64Cart, BULK_WINDOW_BASE
 
 
 # SDRAM configuration
@@ -150,7 +150,7 @@ class BaseSoC(SoCCore):
         setattr(self.submodules, name, ram)
 
     def __init__(self, device="LFE5U-45F", revision="1.0", toolchain="trellis",
-        sys_clk_freq=int(50e6), sdram_rate="1:2",
+        sys_clk_freq=int(50e6), sdram_rate="1:2", bulk_size=0,
         **kwargs):
         platform = kilsyth.Platform(device=device, revision=revision, toolchain=toolchain)
 
@@ -190,6 +190,14 @@ class BaseSoC(SoCCore):
         # Add an extra dedicated SDRAM port for the n64 cart
         sdram_port = self.sdram.crossbar.get_port(data_width=16)
 
+        # Optional bulk transfer window at the top of SDRAM, shared with the N64.
+        # Note that it overlaps the end of the ROM area.
+        bulk_offset = 32 * 1024 * 1024 - bulk_size
+        if bulk_size:
+            self.add_constant("N64_BULK_BASE",   BULK_WINDOW_BASE)
+            self.add_constant("N64_BULK_OFFSET", bulk_offset)
+            self.add_constant("N64_BULK_SIZE",   bulk_size)
+
 
         # Leds -------------------------------------------------------------------------------------
 
@@ -206,6 +214,8 @@ class BaseSoC(SoCCore):
                 mailbox_bus_r = self.mailbox_ram_w.bus_r, # N64 read
                 mailbox_bus_w = self.mailbox_ram_r.bus_w, # N64 write
                 fast_cd       = "sys",
+                bulk_offset   = bulk_offset,
+                bulk_size     = bulk_size,
         )
         self.bus.add_slave("n64slave", self.n64.wb_slave, region=SoCRegion(origin=0x30000000, size=0x10000))
 
@@ -288,6 +298,7 @@ def main():
     parser.add_argument("--revision",        default="1.0",         help="Board revision: 1.0 (default)")
     parser.add_argument("--sys-clk-freq",    default=48e6,          help="System clock frequency  (default: 48MHz)")
     parser.add_argument("--sdram-rate",      default="1:1",         help="SDRAM Rate: 1:1 Full Rate (default), 1:2 Half Rate")
+    parser.add_argument("--bulk-size",       default=0,             type=lambda x: int(x, 0), help="Size of the SDRAM bulk transfer window (default: disabled)")
     builder_args(parser)
     soc_core_args(parser)
     trellis_args(parser)
@@ -299,6 +310,7 @@ def main():
         toolchain              = args.toolchain,
         sys_clk_freq           = int(float(args.sys_clk_freq)),
         sdram_rate             = args.sdram_rate,
+        bulk_size              = args.bulk_size,
         **soc_core_argdict(args))
 
     soc.platform.add_extension(kilsyth._sdcard_pmod_io)
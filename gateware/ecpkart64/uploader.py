@@ -7,18 +7,24 @@
 # SPDX-License-Identifier: BSD-2-Clause
 
 import os
-import sys
 import argparse
 
-import time
-
-from struct import unpack
+from tqdm import tqdm
 from litex import RemoteClient
 
+from .util.load import MAX_BURST, load_binary, verify_binary
+from .util.rom import Rom
+
 def parse_args():
-    parser = argparse.ArgumentParser(description="""ECPKart64 Dump Utility""")
+    parser = argparse.ArgumentParser(description="""ECPKart64 UARTBone ROM Uploader""")
     parser.add_argument("--csr-csv", default="csr.csv", help="SoC CSV file")
-    parser.add_argument("--file", default="bootrom.z64", help="z64 ROM file")
+    parser.add_argument("--file", default="bootrom.z64", help="ROM file, .z64/.v64/.n64 byte order is detected")
+    parser.add_argument("--order", choices=["z64", "v64", "n64"], help="Override the detected ROM byte order")
+    parser.add_argument("--address", type=lambda x: int(x, 0), default=None, help="Load address, main_ram by default")
+    parser.add_argument("--burst", type=int, default=MAX_BURST, help=f"Words per burst write, at most {MAX_BURST}")
+    parser.add_argument("--block-size", type=lambda x: int(x, 0), default=0x100000, help="Bytes read from the ROM at a time")
+    parser.add_argument("--verify", action="store_true", help="Read back and compare after the upload")
+    parser.add_argument("--header", type=lambda x: int(x, 0), default=0x80371240, help="Override the first word of the ROM")
     args = parser.parse_args()
     return args
 
@@ -31,36 +37,41 @@ def main():
                          "the path to the --csr-csv argument of the SoC build.".format(args.csr_csv))
 
     if not os.path.exists(args.file):
-        raise ValueError("{} not found.".format(args.csr_csv))
+        raise ValueError("{} not found.".format(args.file))
+
+    if not 0 < args.burst <= MAX_BURST:
+        raise ValueError(f"--burst must be between 1 and {MAX_BURST}")
+
+    if args.block_size <= 0 or args.block_size % 4:
+        raise ValueError("--block-size must be a positive multiple of 4")
 
-    bus = RemoteClient(csr_csv=args.csr_csv, debug=True)
+    bus = RemoteClient(csr_csv=args.csr_csv)
     bus.open()
 
-    base = bus.mems.main_ram.base
-    print(f"{base:X}")
-    # exit()
+    base = args.address if args.address is not None else bus.mems.main_ram.base
 
     try:
-        with open(args.file, "rb") as f:
-            data_bytes = f.read()[:512]
-            data_quads = list(unpack(f"<{len(data_bytes) // 4}I", data_bytes))
-
-            # for j in range(16):
-            #     sys.stdout.write(f"\n{j*16:08X}: ")
-            #     for i in range(16//4):
-            #         sys.stdout.write(f"{data_quads[j*4 + i]:02X} ")
-            # exit()
-
-            for i in range(0, len(data_quads)):
-                bus.write(base + i*4, data_quads[i])
-                time.sleep(0.1)
-                # bus.write(base + i*4, i)
-
-            # for i in range(0, len(data_quads), 128):
-            #     bus.write(base + i*4, data_quads[i:i+128])
-            #     print(i)
-
-            f.close()
+        with Rom(args.file, args.order) as rom:
+            print(f"Uploading {len(rom)} byte {rom.order} ROM to 0x{base:08X}")
+
+            elapsed = 0
+            with tqdm(total=len(rom), desc="Uploading", unit="B", unit_scale=True) as pbar:
+                for offset, block in rom.blocks(args.block_size):
+                    elapsed += load_binary(bus, base + offset, block, args.burst, pbar.update)
+            print(f"Uploaded {len(rom)} bytes in {elapsed:.1f}s, {len(rom) / elapsed / 1e3:.1f} kB/s")
+
+            if args.verify:
+                bad = []
+                with tqdm(total=len(rom), desc="Verifying", unit="B", unit_scale=True) as pbar:
+                    for offset, block in rom.blocks(args.block_size):
+                        bad += [(offset + o, n) for o, n in verify_binary(bus, base + offset, block, args.burst, pbar.update)]
+                if bad:
+                    for offset, length in bad[:16]:
+                        print(f"Mismatch at 0x{base + offset:08X}, {length} bytes")
+                    raise IOError(f"Verify failed, {len(bad)} bursts differ")
+                print("Verified")
+
+            bus.regs.n64_rom_header.write(args.header)
 
     finally:
         bus.close()
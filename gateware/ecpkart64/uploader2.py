@@ -7,24 +7,230 @@
 # SPDX-License-Identifier: BSD-2-Clause
 
 import os
+import re
+import time
+import hashlib
 import argparse
 
+from queue import Queue
+from threading import Thread
+
 from tqdm import tqdm
 from struct import unpack
 from litex import RemoteClient
 import serial
 
+from .util.framed import FramedLoader, hash_timeout
+from .util.compress import compress
+from .util.rom import Rom
+from .util.load import load_binary
+from .util.library import DEFAULT_LIBRARY, RomLibrary
+
+# Longest run the board decodes before it has to get back to the UART
+UART_MAX_RUN = 1024
+
 def parse_args():
     parser = argparse.ArgumentParser(description="""ECPKart64 Dump Utility""")
     parser.add_argument("--csr-csv", default="csr.csv", help="SoC CSV file")
-    parser.add_argument("--file", default="bootrom.z64", help="z64 ROM file")
+    parser.add_argument("--file", default="bootrom.z64", help="ROM file, .z64/.v64/.n64 byte order is detected")
+    parser.add_argument("--order", choices=["z64", "v64", "n64"], help="Override the detected ROM byte order")
     parser.add_argument("--port", default="/dev/ttyUSB1", help="port")
     parser.add_argument("--baudrate", default="1000000", help="baud")
     parser.add_argument("--header", type=lambda x: int(x, 0), default=0x80371240, help="Override the first word of the ROM")
     parser.add_argument("--cic", action="store_true", help="Starts the CIC app after upload")
+    parser.add_argument("--delta", action="store_true", help="Only upload blocks that differ from what is already in SDRAM")
+    parser.add_argument("--block-size", type=lambda x: int(x, 0), default=0x10000, help="Block size for --delta")
+    parser.add_argument("--framed", action="store_true", help="Upload in CRC checked, acknowledged frames")
+    parser.add_argument("--frame-size", type=lambda x: int(x, 0), default=1024, help="Frame size for --framed")
+    parser.add_argument("--window", type=int, default=16, help="Frames in flight for --framed")
+    parser.add_argument("--compress", choices=["auto", "always", "never"], default="never", help="Compress the upload, decompressed on the board. Needs --framed")
+    parser.add_argument("--segment-size", type=lambda x: int(x, 0), default=0x100000, help="Compressed segment size")
+    parser.add_argument("--split", type=float, nargs="?", const=0.5, default=None, help="Send this fraction of the ROM over UARTBone in parallel (0.5 if no value given)")
+    parser.add_argument("--verify", action="store_true", help="Compare the sha256 of SDRAM with the ROM after the upload")
+    parser.add_argument("--library", nargs="?", const=DEFAULT_LIBRARY, default=None, help=f"ROM library index, skips the upload if the cart already holds the ROM ({DEFAULT_LIBRARY} if no path given)")
+    parser.add_argument("--cart", default=None, help="Cart name in the library, --port by default")
+    parser.add_argument("--force", action="store_true", help="Upload even if the cart already holds the ROM")
     args = parser.parse_args()
     return args
 
+BLOCK_RE = re.compile(r"^block (\d+) ([0-9a-f]{64})$")
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+def remote_sha256(port, base, length):
+    """Asks the firmware for the sha256 of SDRAM."""
+    port.write(bytes(f"sha256 {hex(base)} {length}\n".encode("utf-8")))
+    deadline = time.monotonic() + hash_timeout(length)
+    while time.monotonic() < deadline:
+        line = port.readline().decode("utf-8", errors="ignore").strip()
+        if SHA256_RE.match(line):
+            return line
+    raise TimeoutError("Timed out waiting for the sha256 of SDRAM")
+
+def remote_hashes(port, base, length, block_size, timeout=10.0):
+    """Asks the firmware for the sha256 of each block of SDRAM."""
+    blocks = (length + block_size - 1) // block_size
+    port.write(bytes(f"sha256_blocks {hex(base)} {length} {block_size}\n".encode("utf-8")))
+
+    hashes = {}
+    deadline = time.monotonic() + timeout
+    while len(hashes) < blocks:
+        line = port.readline()
+        if line:
+            deadline = time.monotonic() + timeout
+        elif time.monotonic() > deadline:
+            raise TimeoutError(f"Got {len(hashes)} of {blocks} block hashes")
+        m = BLOCK_RE.match(line.decode("utf-8", errors="ignore").strip())
+        if m:
+            hashes[int(m.group(1))] = m.group(2)
+    return [hashes[i] for i in range(blocks)]
+
+def stale_runs(rom, block_size, hashes):
+    """Returns (index, count) runs of blocks whose hash differs."""
+    runs = []
+    for i, remote in enumerate(hashes):
+        local = hashlib.sha256(rom.view(i*block_size, block_size)).hexdigest()
+        if local == remote:
+            continue
+        if runs and runs[-1][0] + runs[-1][1] == i:
+            runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+        else:
+            runs.append((i, 1))
+    return runs
+
+def estimate_compression(rom, samples=16, sample_size=0x10000):
+    """Compresses evenly spaced samples, returns (ratio, input bytes/s)."""
+    step = max(len(rom) // samples, sample_size)
+    size = packed = 0
+    t0 = time.monotonic()
+    for offset in range(0, len(rom), step):
+        sample = rom.view(offset, sample_size)
+        size += len(sample)
+        packed += len(compress(sample, UART_MAX_RUN))
+    return packed / size, size / max(time.monotonic() - t0, 1e-6)
+
+def compression_wins(rom, baudrate):
+    ratio, rate = estimate_compression(rom)
+    link = baudrate / 10
+    raw = len(rom) / link
+    # Compression runs while the previous segment is being sent
+    packed = max(len(rom) / rate, len(rom) * ratio / link)
+    print(f"Compresses to ~{ratio:.0%}: ~{raw:.1f}s raw, ~{packed:.1f}s compressed")
+    return packed < raw * 0.9
+
+def segments(rom, ranges, segment_size, compressed):
+    """Splits (offset, length) ranges of the ROM into segments and compresses them.
+
+    Yields (offset, view, stream), stream is None where compression doesn't
+    pay off or is off. Runs in a thread so the next segment is read and
+    compressed while the current one is being sent.
+    """
+    queue = Queue(maxsize=2)
+
+    def worker():
+        try:
+            for offset, length in ranges:
+                for start, view in rom.blocks(segment_size, offset, length):
+                    stream = compress(view, UART_MAX_RUN) if compressed else None
+                    if stream is not None and len(stream) > len(view) * 0.9:
+                        stream = None
+                    queue.put((start, view, stream))
+            queue.put(None)
+        except Exception as e:
+            queue.put(e)
+
+    Thread(target=worker, daemon=True).start()
+    while True:
+        item = queue.get()
+        if item is None:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+def load_piece(port, loader, address, data, stream, pbar):
+    """Loads `data` to `address`, decompressed on the board if `stream` is given."""
+    if loader is not None:
+        progress = pbar.update if stream is None else None
+        stats = loader.load(address, data, progress=progress, stream=stream)
+        if stats["resent"] or stats["timeouts"]:
+            tqdm.write(f"Resent {stats['resent']} frames, {stats['naks']} NAKs, {stats['timeouts']} timeouts")
+        if stream is not None:
+            pbar.update(len(data))
+    else:
+        port.write(bytes(f"mem_load {hex(address)} {len(data)}\n".encode("utf-8")))
+        for chunk in range(0, len(data), 1024):
+            port.write(data[chunk:chunk + 1024])
+            pbar.update(len(data[chunk:chunk + 1024]))
+
+def upload(port, loader, base, rom, ranges, compressed, segment_size):
+    total = sum(length for _, length in ranges)
+    if loader is not None:
+        # Replies are parsed, drop the console output of leaving the CIC loop
+        time.sleep(0.1)
+        port.reset_input_buffer()
+    with tqdm(total=total, desc="Uploading", unit="B", unit_scale=True) as pbar:
+        for offset, view, stream in segments(rom, ranges, segment_size, compressed):
+            load_piece(port, loader, base + offset, view, stream, pbar)
+
+def upload_split(port, loader, bus, base, rom, compressed, segment_size, fraction):
+    """Uploads the end of the ROM over UARTBone while the rest goes over the console."""
+    split = int(len(rom) * (1 - fraction))
+    split -= split % 0x1000
+    if loader is not None:
+        time.sleep(0.1)
+        port.reset_input_buffer()
+
+    errors = []
+    elapsed = {}
+    t0 = time.monotonic()
+    with tqdm(total=len(rom), desc="Uploading", unit="B", unit_scale=True) as pbar:
+        def uartbone():
+            try:
+                for offset, block in rom.blocks(segment_size, split):
+                    load_binary(bus, base + offset, block, progress=pbar.update)
+            except Exception as e:
+                errors.append(e)
+            elapsed["uartbone"] = time.monotonic() - t0
+
+        thread = Thread(target=uartbone, daemon=True)
+        thread.start()
+        for offset, view, stream in segments(rom, [(0, split)], segment_size, compressed):
+            load_piece(port, loader, base + offset, view, stream, pbar)
+        elapsed["console"] = time.monotonic() - t0
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    total = time.monotonic() - t0
+    print(f"Console {split} bytes in {elapsed['console']:.1f}s, "
+          f"UARTBone {len(rom) - split} bytes in {elapsed['uartbone']:.1f}s, "
+          f"{len(rom) / total / 1e3:.1f} kB/s combined")
+
+def upload_delta(port, base, rom, block_size, loader=None, compressed=False, segment_size=0x100000):
+    # Drain the console output of leaving the CIC loop before parsing hashes
+    time.sleep(0.1)
+    port.reset_input_buffer()
+
+    hashes = remote_hashes(port, base, len(rom), block_size)
+    runs = stale_runs(rom, block_size, hashes)
+    stale = sum(count for _, count in runs)
+    print(f"{stale} of {len(hashes)} blocks changed")
+
+    if loader is not None:
+        ranges = [(index * block_size, count * block_size) for index, count in runs]
+        upload(port, loader, base, rom, ranges, compressed, segment_size)
+        return
+
+    with tqdm(total=stale, desc="Uploading", bar_format="{l_bar}{bar} [ time left: {remaining} ]") as pbar:
+        for index, count in runs:
+            port.write(bytes(f"mem_load_block {hex(base)} {hex(block_size)} {index} {count}\n".encode("utf-8")))
+            for i in range(index, index + count):
+                block = rom.view(i*block_size, block_size)
+                port.write(block)
+                # mem_load_block always loads whole blocks, pad the last one
+                port.write(bytes(block_size - len(block)))
+                pbar.update(1)
+
 def main():
     args = parse_args()
 
@@ -36,27 +242,85 @@ def main():
     if not os.path.exists(args.file):
         raise ValueError("{} not found.".format(args.csr_csv))
 
-    bus = RemoteClient(csr_csv=args.csr_csv, debug=True)
+    if args.block_size <= 0 or args.block_size % 4:
+        raise ValueError("--block-size must be a positive multiple of 4")
+
+    if args.frame_size <= 0 or args.frame_size > 4096 or args.frame_size % 4:
+        raise ValueError("--frame-size must be a multiple of 4 up to 4096")
+
+    if args.split is not None and not 0 < args.split < 1:
+        raise ValueError("--split must be between 0 and 1")
+
+    if args.split is not None and args.delta:
+        raise ValueError("--split and --delta can't be combined")
+
+    # mem_load_compressed has no flow control, runs can overrun the UART
+    if args.compress != "never" and not args.framed:
+        raise ValueError("--compress needs --framed")
+
+    bus = RemoteClient(csr_csv=args.csr_csv)
     base = bus.mems.main_ram.base
 
-    port = serial.serial_for_url(args.port, args.baudrate)
+    port = serial.serial_for_url(args.port, args.baudrate, timeout=1)
+    loader = FramedLoader(port, args.frame_size, args.window) if args.framed else None
 
     try:
-        with open(args.file, "rb") as f:
-            print("Opening...")
-            data_bytes = f.read()
-            port.write(bytes(f"\n\n\n\nmem_load {hex(base)} {len(data_bytes)}\n".encode("utf-8")))
+        with Rom(args.file, args.order) as rom:
+            print(f"Opening {rom.order} ROM...")
+
+            library = RomLibrary(args.library) if args.library else None
+            cart = args.cart or args.port
+            if library is not None:
+                sha256 = library.add(rom)
+                info = library.find(sha256)
+                print(f"{info['title']}  sha256 {sha256[:16]}  CIC {info['cic'] or 'unknown'}")
+                if info["cic"] not in (None, "6102"):
+                    print("Warning: the firmware only emulates a 6102 CIC")
+
+            port.write(b"\n\n\n\n")
 
-            chunks = (len(data_bytes) + 1023) // 1024
-            with tqdm(total=chunks, desc="Uploading", bar_format="{l_bar}{bar} [ time left: {remaining} ]") as pbar:
-                for chunk in range(chunks):
-                    port.write(data_bytes[chunk*1024:(chunk+1)*1024])
-                    pbar.update(1)
+            # Only ask the cart when it was last loaded with this ROM, hashing
+            # all of SDRAM on the soft CPU isn't free either
+            last = library.cart(cart) if library is not None else None
+            if last is not None and last["sha256"] == sha256 and not args.force:
+                time.sleep(0.1)
+                port.reset_input_buffer()
+                if remote_sha256(port, base, len(rom)) == sha256:
+                    print("Cart already holds this ROM, skipping upload")
+                    upload_rom = False
+                else:
+                    print("Cart contents changed, uploading")
+                    upload_rom = True
+            else:
+                upload_rom = True
+
+            if upload_rom:
+                if args.compress == "auto":
+                    compressed = compression_wins(rom, int(args.baudrate))
+                else:
+                    compressed = args.compress == "always"
+
+                if args.delta:
+                    upload_delta(port, base, rom, args.block_size, loader, compressed, args.segment_size)
+                elif args.split is not None:
+                    bus.open()
+                    upload_split(port, loader, bus, base, rom, compressed, args.segment_size, args.split)
+                else:
+                    upload(port, loader, base, rom, [(0, len(rom))], compressed, args.segment_size)
+
+                # Both halves of a split upload are only checked here
+                if args.verify or args.split is not None:
+                    if remote_sha256(port, base, len(rom)) != rom.sha256():
+                        raise IOError("SDRAM does not match the ROM after upload")
+                    print("Verified")
 
             port.write(bytes(f"set_header {hex(args.header)}\n".encode("utf-8")))
             if args.cic:
                 port.write(bytes(f"cic\n".encode("utf-8")))
-            f.close()
+
+            if library is not None:
+                library.loaded(cart, sha256, args.header, info["cic"])
+                library.save()
             print("Done...")
 
     finally:
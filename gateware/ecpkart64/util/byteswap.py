@@ -5,7 +5,9 @@
 # Copyright (c) 2021-2022 Konrad Beckmann <konrad.beckmann@gmail.com
 # SPDX-License-Identifier: BSD-2-Clause
 
-import struct
+import sys
+
+from array import array
 
 __all__ = [
     "unpack_uint32_le",
@@ -13,13 +15,70 @@ __all__ = [
     "pack_uint32_le",
     "pack_uint32_be",
     "bswap32",
+    "words_le",
+    "words_be",
+    "swap16",
+    "swap32",
 ]
 
+# array typecode of a native uint32
+UINT32 = "I" if array("I").itemsize == 4 else "L"
+LITTLE = sys.byteorder == "little"
+
+
+def swap16(buf):
+    """Swaps the bytes of every 16-bit halfword of `buf` in place.
+
+    `buf` is any writable contiguous buffer: bytearray, memoryview, array or
+    NumPy array. Returns `buf`.
+    """
+    m = memoryview(buf).cast("B")
+    assert(len(m) % 2 == 0)
+    b0 = bytes(m[0::2])
+    m[0::2] = m[1::2]
+    m[1::2] = b0
+    return buf
+
+
+def swap32(buf):
+    """Swaps the bytes of every 32-bit word of `buf` in place. Returns `buf`."""
+    m = memoryview(buf).cast("B")
+    assert(len(m) % 4 == 0)
+    b0 = bytes(m[0::4])
+    b1 = bytes(m[1::4])
+    m[0::4] = m[3::4]
+    m[1::4] = m[2::4]
+    m[2::4] = b1
+    m[3::4] = b0
+    return buf
+
+
+def _words(x, little):
+    words = array(UINT32)
+    words.frombytes(x)
+    if little != LITTLE:
+        words.byteswap()
+    return words
+
+
+def _bytes(x, little):
+    if little == LITTLE and isinstance(x, array) and x.typecode == UINT32:
+        return x.tobytes()
+    x = array(UINT32, x)
+    if little != LITTLE:
+        x.byteswap()
+    return x.tobytes()
+
+
+# Words as an array of native uint32, without an int object per word
+def words_le(x): return _words(x, True)
+def words_be(x): return _words(x, False)
 
-def unpack_uint32_le(x): return list(struct.unpack(f"<{len(x)//4}I", x))
-def unpack_uint32_be(x): return list(struct.unpack(f">{len(x)//4}I", x))
-def pack_uint32_le(x): return struct.pack(f"<{len(x)}I", *x)
-def pack_uint32_be(x): return struct.pack(f">{len(x)}I", *x)
+# RemoteClient.write() takes a list, so the unpack helpers return one.
+def unpack_uint32_le(x): return words_le(x).tolist()
+def unpack_uint32_be(x): return words_be(x).tolist()
+def pack_uint32_le(x): return _bytes(x, True)
+def pack_uint32_be(x): return _bytes(x, False)
 
 
 def bswap32(x):
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+#
+# This file is part of ECPKart64.
+#
+# Copyright (c) 2022 Konrad Beckmann <konrad.beckmann@gmail.com
+# SPDX-License-Identifier: BSD-2-Clause
+
+__all__ = ["compress", "compress_chunks", "decompress_into"]
+
+# Byte oriented RLE + LZ stream, cheap to decode on the N64.
+#
+#   0x00-0x7f  literals: the next c+1 bytes are copied to the output
+#   0x80-0xfe  match: copy c-0x80+4 bytes from `distance` bytes back,
+#              distance follows as u16be (1..65535), may overlap
+#   0xff       run: u16be length (1..65535) followed by the byte value
+#
+# Matches may reach back into the output of earlier chunks of the same
+# stream, which the decoder has already written to memory.
+
+MAX_LITERALS = 0x80
+MIN_MATCH    = 4
+MAX_MATCH    = 0xfe - 0x80 + MIN_MATCH
+MAX_DISTANCE = 0xffff
+MIN_RUN      = 5
+MAX_RUN      = 0xffff
+
+
+def _literal_cost(n):
+    return n + (n + MAX_LITERALS - 1) // MAX_LITERALS
+
+
+def _emit_literals(out, data, start, end):
+    for i in range(start, end, MAX_LITERALS):
+        n = min(MAX_LITERALS, end - i)
+        out.append(n - 1)
+        out += data[i:i + n]
+
+
+def _run_length(data, pos, limit):
+    value = data[pos:pos + 1]
+    end = pos + 1
+    step = 16
+    while end < limit:
+        n = min(step, limit - end)
+        if data[end:end + n] != value * n:
+            break
+        end += n
+        step = min(step * 2, 4096)
+    while end < limit and data[end] == value[0]:
+        end += 1
+    return end - pos
+
+
+def _match_length(data, src, pos, limit):
+    n = 0
+    while n < limit and data[src + n] == data[pos + n]:
+        n += 1
+    return n
+
+
+def compress_chunks(data: bytes, budget: int, max_run: int = MAX_RUN):
+    """Compresses `data` into independently framed chunks.
+
+    Yields (offset, length, stream) where `stream` is at most `budget` bytes
+    and decompresses to data[offset:offset + length]. Chunks must be decoded
+    in order into the same buffer. Runs are split at `max_run` bytes, for
+    decoders that can't spend long on a single token.
+    """
+    assert(budget >= 4)
+    assert(MIN_RUN <= max_run <= MAX_RUN)
+    data = bytes(data)
+    size = len(data)
+    table = {}
+
+    out = bytearray()
+    start = 0       # output offset of the current chunk
+    literals = 0    # start of the pending literals
+    pos = 0
+
+    while pos < size:
+        token = None
+        length = 1
+
+        if pos + 1 < size and data[pos + 1] == data[pos]:
+            run = _run_length(data, pos, min(size, pos + max_run))
+            if run >= MIN_RUN:
+                token = bytes((0xff, run >> 8, run & 0xff, data[pos]))
+                length = run
+
+        if token is None and pos + MIN_MATCH <= size:
+            key = data[pos:pos + MIN_MATCH]
+            src = table.get(key)
+            table[key] = pos
+            if src is not None and pos - src <= MAX_DISTANCE:
+                n = _match_length(data, src, pos, min(MAX_MATCH, size - pos))
+                if n >= MIN_MATCH:
+                    distance = pos - src
+                    token = bytes((0x80 + n - MIN_MATCH, distance >> 8, distance & 0xff))
+                    length = n
+
+        pending = _literal_cost(pos - literals)
+        if token is None:
+            # Close the chunk if one more literal would not fit
+            if len(out) + _literal_cost(pos + 1 - literals) > budget:
+                _emit_literals(out, data, literals, pos)
+                yield start, pos - start, bytes(out)
+                out = bytearray()
+                start = literals = pos
+            pos += 1
+            continue
+
+        if len(out) + pending + len(token) > budget:
+            _emit_literals(out, data, literals, pos)
+            yield start, pos - start, bytes(out)
+            out = bytearray()
+            start = literals = pos
+
+        _emit_literals(out, data, literals, pos)
+        out += token
+        pos += length
+        literals = pos
+
+    _emit_literals(out, data, literals, pos)
+    if out:
+        yield start, pos - start, bytes(out)
+
+
+def compress(data: bytes, max_run: int = MAX_RUN):
+    """Compresses `data` into a single stream."""
+    return b"".join(stream for _, _, stream in compress_chunks(data, 64 * 1024, max_run))
+
+
+def decompress_into(buf, offset: int, stream: bytes, length: int):
+    """Decodes `stream` into buf[offset:offset + length].
+
+    Matches read from the bytes before `offset` in `buf`, i.e. the output of
+    earlier chunks. Trailing padding after `length` bytes is ignored.
+    """
+    end = offset + length
+    out = offset
+    i = 0
+    while out < end:
+        c = stream[i]
+        if c < 0x80:
+            n = c + 1
+            if out + n > end:
+                raise ValueError("Literals past the end of the output")
+            buf[out:out + n] = stream[i + 1:i + 1 + n]
+            i += 1 + n
+        elif c < 0xff:
+            n = c - 0x80 + MIN_MATCH
+            distance = (stream[i + 1] << 8) | stream[i + 2]
+            if out + n > end or distance == 0 or distance > out:
+                raise ValueError("Invalid match")
+            src = out - distance
+            if distance >= n:
+                buf[out:out + n] = buf[src:src + n]
+            else:
+                for j in range(n):
+                    buf[out + j] = buf[src + j]
+            i += 3
+        else:
+            n = (stream[i + 1] << 8) | stream[i + 2]
+            if out + n > end:
+                raise ValueError("Run past the end of the output")
+            buf[out:out + n] = bytes((stream[i + 3],)) * n
+            i += 4
+        out += n
+    return i
@@ -6,24 +6,153 @@
 # SPDX-License-Identifier: BSD-2-Clause
 
 import os
+import time
 import argparse
-import struct
 
+from collections import deque
 from litex import RemoteClient
 
+from .byteswap import pack_uint32_le, unpack_uint32_le
+
+__all__ = ["Dumper", "dump_array", "dump_binary"]
+
+# Etherbone records, and so litex_server, carry at most 255 words
+MAX_CHUNK = 255
+
+
+class Dumper():
+    """Reads memory in chunks over an open bus.
+
+    On a RemoteClient, `depth` read requests are kept queued on the
+    connection, so litex_server starts on the next chunk as soon as it has
+    answered one. Other buses, e.g. runner.sim.SimBus, are read one chunk at
+    a time.
+
+    Tracks the bytes read and the time spent reading, for throughput().
+    """
+
+    def __init__(self, bus, chunk_words=MAX_CHUNK, depth=4):
+        assert(0 < chunk_words <= MAX_CHUNK)
+        self.bus = bus
+        self.chunk_words = chunk_words
+        self.depth = depth
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    def throughput(self):
+        return self.bytes / self.elapsed if self.elapsed else None
+
+    def _pipelined(self):
+        return self.depth > 1 and getattr(self.bus, "binded", False) and hasattr(self.bus, "send_packet")
+
+    def _request(self, address, words):
+        from litex.tools.remote.etherbone import EtherbonePacket, EtherboneRecord, EtherboneReads
+        bus = self.bus
+        addr_size = bus.csr_bus_address_width // 8
+        record = EtherboneRecord(addr_size)
+        record.reads = EtherboneReads(
+            addr_size = addr_size,
+            addrs     = [bus.base_address + address + 4 * j for j in range(words)]
+        )
+        record.rcount = len(record.reads)
+        packet = EtherbonePacket(bus.csr_bus_address_width)
+        packet.records = [record]
+        packet.encode()
+        bus.send_packet(bus.socket, packet)
+
+    def _receive(self):
+        data = self._response()
+        self.bytes += 4 * len(data)
+        return pack_uint32_le(data)
+
+    def _response(self):
+        from litex.tools.remote.etherbone import EtherbonePacket
+        bus = self.bus
+        response = bus.receive_packet(bus.socket, bus.csr_bus_address_width // 8)
+        if response == 0:
+            raise TimeoutError("No response from litex_server")
+        packet = EtherbonePacket(addr_width=bus.csr_bus_address_width, init=response)
+        packet.decode()
+        return packet.records.pop().writes.get_datas()
+
+    def chunks(self, base, length, offset=0):
+        """Yields (offset, data) for `length` bytes at `base`, from `offset` on.
+
+        `length` is rounded up to whole words.
+        """
+        words = (length + 3) // 4
+        requests = [(o, min(self.chunk_words, words - o // 4))
+                    for o in range(offset - offset % 4, words * 4, self.chunk_words * 4)]
+
+        in_flight = deque()
+        t0 = time.monotonic()
+        try:
+            if not self._pipelined():
+                for o, n in requests:
+                    data = self.bus.read(base + o, n)
+                    # Data is received in 32-bit little-endian
+                    yield o, pack_uint32_le(data)
+                    self.bytes += 4 * n
+                return
+
+            # Responses come back in request order
+            for o, n in requests:
+                if len(in_flight) >= self.depth:
+                    yield in_flight.popleft(), self._receive()
+                self._request(base + o, n)
+                in_flight.append(o)
+            while in_flight:
+                yield in_flight.popleft(), self._receive()
+        finally:
+            # Don't leave responses on the connection if we were stopped early
+            while in_flight:
+                in_flight.popleft()
+                self._response()
+            self.elapsed += time.monotonic() - t0
+
+    def dump(self, base, length, out=None, offset=0, progress=None):
+        """Reads `length` bytes at `base`, starting at `offset`.
+
+        Chunks are written to `out` as they arrive if it is a file, or passed
+        to it as out(offset, data) if it is callable. Without `out`, returns
+        the data from `offset` on.
+        """
+        buf = bytearray() if out is None else None
+        for o, data in self.chunks(base, length, offset):
+            data = data[:max(length - o, 0)]
+            if buf is not None:
+                buf += data
+            elif callable(out):
+                out(o, data)
+            else:
+                out.write(data)
+            if progress is not None:
+                progress(len(data))
+        return bytes(buf) if buf is not None else None
+
+    def dump_file(self, path, base, length, resume=False, progress=None):
+        """Dumps to `path`. With `resume`, continues after what the file already holds."""
+        offset = 0
+        if resume and os.path.exists(path):
+            offset = min(os.path.getsize(path), length)
+            offset -= offset % 4
+        with open(path, "r+b" if offset else "wb") as f:
+            f.seek(offset)
+            f.truncate()
+            self.dump(base, length, f, offset, progress)
+        return offset
+
+
 def dump_array(csr_csv, base, words):
     bus = RemoteClient(csr_csv=csr_csv)
     bus.open()
 
     data = []
-    total_words = words
-    chunks = (total_words + 127) // 128
-    for i in range(chunks):
-        chunk = bus.read(base + 4 * 128 * i, 128 if i != chunks - 1 else total_words)
-        data += chunk
-        total_words -= 128
-
-    bus.close()
+    try:
+        for _, chunk in Dumper(bus).chunks(base, words * 4):
+            data += unpack_uint32_le(chunk)
+    finally:
+        bus.close()
 
     return data
 
@@ -31,15 +160,7 @@ def dump_binary(csr_csv, base, words):
     bus = RemoteClient(csr_csv=csr_csv)
     bus.open()
 
-    data = b''
-    total_words = words
-    chunks = (total_words + 127) // 128
-    for i in range(chunks):
-        chunk = bus.read(base + 4 * 128 * i, 128 if i != chunks - 1 else total_words)
-        # Data is received in 32-bit little-endian
-        data += struct.pack(f"<{len(chunk)}I", *chunk)
-        total_words -= 128
-
-    bus.close()
-
-    return data
+    try:
+        return Dumper(bus).dump(base, words * 4)
+    finally:
+        bus.close()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+#
+# This file is part of ECPKart64.
+#
+# Copyright (c) 2022 Konrad Beckmann <konrad.beckmann@gmail.com
+# SPDX-License-Identifier: BSD-2-Clause
+
+import time
+import zlib
+import struct
+import hashlib
+
+__all__ = ["FramedLoader", "hash_timeout"]
+
+# Host side of the mem_load_framed console command, see sw/main.c for the
+# frame layout.
+SYNC     = b"\xa5\x5a"
+ACK      = 0x06
+NAK      = 0x15
+ABORT    = 0xffff_ffff
+HEADER   = struct.Struct("<IH")
+CRC      = struct.Struct("<I")
+REPLY    = struct.Struct("<BI")
+
+READY    = "framed_load ready"
+SUMMARY  = b"framed_load "
+HASH     = "framed_load sha256 "
+FAILED   = ("framed_load timeout", "framed_load aborted", "framed_load error", "Invalid frame size")
+
+# SHA256 throughput of the firmware on the soft CPU, in bytes/s
+SHA256_RATE = 250e3
+
+
+def frame(index, payload):
+    # Frames are whole words, pad the last one
+    payload = bytes(payload) + bytes(-len(payload) % 4)
+    header = HEADER.pack(index, len(payload))
+    return SYNC + header + payload + CRC.pack(zlib.crc32(payload, zlib.crc32(header)))
+
+
+def hash_timeout(length):
+    """Seconds to allow the firmware for hashing `length` bytes of SDRAM."""
+    return 10.0 + length / SHA256_RATE
+
+
+class FramedLoader():
+    """Loads memory over the console UART with CRC checked frames.
+
+    Up to `window` frames of `frame_size` bytes are in flight at once. The
+    firmware acknowledges every frame and asks for a resend from the first
+    frame it lost (go-back-N). If no reply arrives within `timeout` seconds,
+    everything from the oldest unacknowledged frame is resent, and the load
+    is aborted after `retries` timeouts in a row. Finally the firmware's
+    SHA256 of the loaded region is compared with the data.
+    """
+
+    def __init__(self, port, frame_size=1024, window=16, timeout=1.0, retries=10):
+        assert(frame_size % 4 == 0 and 0 < frame_size <= 4096)
+        self.port = port
+        self.frame_size = frame_size
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+
+    def _readline(self, deadline):
+        line = bytearray()
+        while time.monotonic() < deadline:
+            c = self.port.read(1)
+            if not c:
+                continue
+            if c == b"\n":
+                return line.decode("utf-8", errors="ignore").strip()
+            line += c
+        raise TimeoutError("No response from the firmware")
+
+    def _expect(self, prefix, timeout):
+        """Skips console output until a line starting with `prefix`."""
+        deadline = time.monotonic() + timeout
+        while True:
+            line = self._readline(deadline)
+            if line.startswith(prefix):
+                return line[len(prefix):]
+            for failure in FAILED:
+                if line.startswith(failure):
+                    raise IOError(line)
+
+    def _reply(self, pending, timeout):
+        """Returns the next (type, next) reply, ("line", text) for a summary line, or None on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            # Skip anything before the next reply or summary, e.g. console output
+            starts = [i for i in (pending.find(ACK), pending.find(NAK), pending.find(SUMMARY)) if i >= 0]
+            if starts:
+                del pending[:min(starts)]
+            else:
+                # Keep what could be the start of a summary line
+                del pending[:max(len(pending) - len(SUMMARY) + 1, 0)]
+
+            if pending.startswith(SUMMARY):
+                end = pending.find(b"\n")
+                if end >= 0:
+                    line = pending[:end].decode("utf-8", errors="ignore").strip()
+                    del pending[:end + 1]
+                    return "line", line
+            elif pending and pending[0] in (ACK, NAK) and len(pending) >= REPLY.size:
+                reply = REPLY.unpack_from(pending)
+                del pending[:REPLY.size]
+                return reply
+            if time.monotonic() > deadline:
+                return None
+            pending += self.port.read(max(self.port.in_waiting, 1))
+
+    def abort(self):
+        self.port.write(frame(ABORT, b""))
+
+    def load(self, address, data, progress=None, stream=None):
+        """Loads `data` to `address`, returns transfer statistics.
+
+        If `stream` is given, the frames carry it instead and the firmware
+        decompresses it into `data`, see util/compress.py. `progress` is
+        called with the number of frame bytes acknowledged since the previous
+        call. Raises IOError if the data doesn't arrive intact.
+        """
+        data = memoryview(data).cast("B")
+        length = len(data)
+        payload = data if stream is None else memoryview(stream).cast("B")
+        size = self.frame_size
+        count = (len(payload) + size - 1) // size
+
+        timeout, self.port.timeout = self.port.timeout, min(self.timeout, 0.1)
+        t0 = time.monotonic()
+        stats = dict(frames=count, payload=len(payload), resent=0, naks=0, timeouts=0)
+        try:
+            command = f"mem_load_framed {hex(address)} {length} {size}"
+            if stream is not None:
+                command += f" {len(payload)}"
+            self.port.write(f"{command}\n".encode("utf-8"))
+            self._expect(READY, self.timeout)
+
+            # Once every frame has been sent, resends could reach the console
+            # after the firmware is done, so just wait for the replies. The
+            # firmware NAKs its next frame when the link goes idle, in case
+            # the last frames were lost.
+            finish = self.timeout + hash_timeout(length)
+            base = sent = high = 0
+            failures = 0
+            summary = None
+            pending = bytearray()
+            while summary is None:
+                while sent < count and sent - base < self.window:
+                    if sent < high:
+                        stats["resent"] += 1
+                    self.port.write(frame(sent, payload[sent * size:(sent + 1) * size]))
+                    sent += 1
+                    high = max(high, sent)
+
+                reply = self._reply(pending, finish if high == count else self.timeout)
+                if reply is None:
+                    stats["timeouts"] += 1
+                    failures += 1
+                    if failures > self.retries or high == count:
+                        self.abort()
+                        raise IOError(f"Framed load stalled at frame {base} of {count}")
+                    sent = base
+                    continue
+
+                kind, index = reply
+                if kind == "line":
+                    # Printed after the last frame, so it acknowledges all of them
+                    summary = index
+                    if progress is not None and base < count:
+                        progress(len(payload) - base * size)
+                    base = count
+                elif kind == ACK and index > base:
+                    if progress is not None:
+                        progress(min(index * size, len(payload)) - base * size)
+                    base = index
+                    failures = 0
+                elif kind == NAK and index >= base:
+                    stats["naks"] += 1
+                    if progress is not None and index > base:
+                        progress(min(index * size, len(payload)) - base * size)
+                    base = sent = index
+
+            if not summary.startswith(HASH):
+                raise IOError(summary)
+            digest = summary[len(HASH):]
+            if digest != hashlib.sha256(data).hexdigest():
+                raise IOError(f"SHA256 mismatch after framed load: {digest}")
+        finally:
+            self.port.timeout = timeout
+
+        stats["elapsed"] = time.monotonic() - t0
+        stats["throughput"] = length / stats["elapsed"]
+        return stats
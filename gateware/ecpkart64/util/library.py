@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+#
+# This file is part of ECPKart64.
+#
+# Copyright (c) 2022 Konrad Beckmann <konrad.beckmann@gmail.com
+# SPDX-License-Identifier: BSD-2-Clause
+
+import os
+import json
+import time
+
+__all__ = ["DEFAULT_LIBRARY", "RomLibrary"]
+
+DEFAULT_LIBRARY = os.path.join(os.path.expanduser("~"), ".ecpkart64", "library.json")
+
+
+class RomLibrary():
+    """Index of ROMs by content hash, and of what each cart was last loaded with.
+
+    Stored as JSON:
+
+        roms:  sha256 -> path, order, size, header, cic, title
+        carts: name   -> sha256, size, header, cic, time
+
+    A cart entry only says what the host last loaded, SDRAM is lost on
+    power down, so the cart has to be asked before trusting it.
+    """
+
+    def __init__(self, path=DEFAULT_LIBRARY):
+        self.path = path
+        self.roms = {}
+        self.carts = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                index = json.load(f)
+            self.roms = index.get("roms", {})
+            self.carts = index.get("carts", {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(dict(roms=self.roms, carts=self.carts), f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def add(self, rom):
+        """Indexes a Rom, returns its sha256."""
+        sha256 = rom.sha256()
+        self.roms[sha256] = dict(
+            path=os.path.abspath(rom.path),
+            order=rom.order,
+            size=len(rom),
+            header=int.from_bytes(rom.header()[:4], "big"),
+            cic=rom.cic(),
+            title=rom.title(),
+        )
+        return sha256
+
+    def find(self, sha256):
+        return self.roms.get(sha256)
+
+    def cart(self, name):
+        return self.carts.get(name)
+
+    def loaded(self, name, sha256, header, cic):
+        """Records that cart `name` now holds ROM `sha256`."""
+        self.carts[name] = dict(
+            sha256=sha256,
+            size=self.roms[sha256]["size"],
+            header=header,
+            cic=cic,
+            time=time.time(),
+        )
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+#
+# This file is part of ECPKart64.
+#
+# Copyright (c) 2022 Konrad Beckmann <konrad.beckmann@gmail.com
+# SPDX-License-Identifier: BSD-2-Clause
+
+import time
+
+from .byteswap import unpack_uint32_le
+
+__all__ = ["MAX_BURST", "load_binary", "verify_binary"]
+
+# Etherbone records, and so litex_server, carry at most 255 words
+MAX_BURST = 255
+
+
+def _bursts(data, burst):
+    """Yields (offset, words) for each burst of `data`, the last word zero padded."""
+    data = memoryview(data).cast("B")
+    step = burst * 4
+    for offset in range(0, len(data), step):
+        chunk = data[offset:offset + step]
+        if len(chunk) % 4:
+            chunk = bytes(chunk) + bytes(-len(chunk) % 4)
+        # Memory is written in 32-bit little-endian
+        yield offset, unpack_uint32_le(chunk)
+
+
+def load_binary(bus, base, data, burst=MAX_BURST, progress=None):
+    """Writes `data` to `base` with burst writes, returns the time it took.
+
+    Writes are posted, so bursts are sent back to back. A read at the end
+    waits until the bridge has executed all of them. `progress` is called
+    with the number of bytes sent by each burst.
+    """
+    assert(0 < burst <= MAX_BURST)
+    t0 = time.monotonic()
+    for offset, words in _bursts(data, burst):
+        bus.write(base + offset, words)
+        if progress is not None:
+            progress(min(len(words) * 4, len(data) - offset))
+    if len(data):
+        bus.read(base)
+    return time.monotonic() - t0
+
+
+def verify_binary(bus, base, data, burst=MAX_BURST, progress=None):
+    """Reads back `data` from `base`, returns the (offset, length) bursts that differ."""
+    assert(0 < burst <= MAX_BURST)
+    bad = []
+    for offset, words in _bursts(data, burst):
+        if bus.read(base + offset, len(words)) != words:
+            bad.append((offset, min(len(words) * 4, len(data) - offset)))
+        if progress is not None:
+            progress(min(len(words) * 4, len(data) - offset))
+    return bad
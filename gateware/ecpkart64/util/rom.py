@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+#
+# This file is part of ECPKart64.
+#
+# Copyright (c) 2022 Konrad Beckmann <konrad.beckmann@gmail.com
+# SPDX-License-Identifier: BSD-2-Clause
+
+import mmap
+import zlib
+import hashlib
+
+from .byteswap import swap16, swap32
+
+__all__ = ["Rom", "detect_order"]
+
+# The first word of every ROM is the PI configuration, 0x80371240, stored
+# in one of three byte orders depending on the dumper.
+ORDERS = {
+    b"\x80\x37\x12\x40": "z64",     # big-endian, as the N64 reads it
+    b"\x37\x80\x40\x12": "v64",     # 16-bit halfwords swapped
+    b"\x40\x12\x37\x80": "n64",     # 32-bit words swapped
+}
+
+# Alignment each order is converted in
+ALIGN = {"z64": 1, "v64": 2, "n64": 4}
+
+# CRC-32 of the IPL3 boot code at 0x40-0x1000, by the CIC it was signed for
+CIC_CRC = {
+    0x6170a4a1: "6101",
+    0x90bb6cb5: "6102",
+    0x0b050ee0: "6103",
+    0x98bc2c86: "6105",
+    0xacc8580a: "6106",
+    0x009e9ea3: "7102",
+    0x0e018159: "8303",
+}
+
+
+def detect_order(header):
+    """Returns "z64", "v64" or "n64" from the first 4 bytes of a ROM."""
+    order = ORDERS.get(bytes(header[:4]))
+    if order is None:
+        raise ValueError(f"Unknown ROM byte order, header starts with {bytes(header[:4]).hex()}")
+    return order
+
+
+class Rom():
+    """A memory mapped ROM file, read in .z64 byte order.
+
+    Nothing is read up front: view() maps the requested range of the file,
+    and .v64/.n64 ROMs are converted one range at a time. Memory use depends
+    on the size of the ranges asked for, not on the size of the ROM.
+    """
+
+    def __init__(self, path, order=None):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.map)
+        self.order = order or detect_order(self.map[:4])
+        if self.size % ALIGN[self.order]:
+            raise ValueError(f"{path}: {self.order} ROM size must be a multiple of {ALIGN[self.order]}")
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            # Views from view() are still alive, e.g. in the traceback of an
+            # exception leaving a with block. The map is released with them.
+            pass
+        self.file.close()
+
+    def view(self, offset=0, length=None):
+        """Returns `length` bytes at `offset` in .z64 order as a memoryview.
+
+        .z64 ROMs are returned straight from the mapping without a copy, the
+        others are copied and swapped into a new buffer.
+        """
+        if length is None:
+            length = self.size - offset
+        length = max(min(length, self.size - offset), 0)
+        align = ALIGN[self.order]
+        if align == 1:
+            return memoryview(self.map)[offset:offset + length]
+
+        # Convert whole halfwords/words around the range
+        start = offset - offset % align
+        end = min(offset + length + -(offset + length) % align, self.size)
+        buf = bytearray(self.map[start:end])
+        if self.order == "v64":
+            swap16(buf)
+        else:
+            swap32(buf)
+        return memoryview(buf)[offset - start:offset - start + length]
+
+    def blocks(self, block_size=0x100000, offset=0, length=None):
+        """Yields (offset, view) for consecutive blocks of the range."""
+        if length is None:
+            length = self.size - offset
+        end = min(offset + length, self.size)
+        for start in range(offset, end, block_size):
+            yield start, self.view(start, min(block_size, end - start))
+
+    def header(self):
+        """The 64 byte ROM header in .z64 order."""
+        return bytes(self.view(0, 64))
+
+    def title(self):
+        """The internal name from the header."""
+        return bytes(self.view(0x20, 20)).decode("ascii", errors="replace").strip(" \0")
+
+    def cic(self):
+        """The CIC type the boot code is signed for, or None if unknown."""
+        return CIC_CRC.get(zlib.crc32(self.view(0x40, 0x1000 - 0x40)))
+
+    def sha256(self, offset=0, length=None, block_size=0x100000):
+        h = hashlib.sha256()
+        for _, block in self.blocks(block_size, offset, length):
+            h.update(block)
+        return h.hexdigest()
@@ -0,0 +1,26 @@
+#include "crc32.h"
+
+static uint32_t table[256];
+static int table_ready = 0;
+
+static void crc32_init(void)
+{
+	for (uint32_t i = 0; i < 256; i++) {
+		uint32_t c = i;
+		for (int j = 0; j < 8; j++)
+			c = (c & 1) ? (0xedb88320 ^ (c >> 1)) : (c >> 1);
+		table[i] = c;
+	}
+	table_ready = 1;
+}
+
+uint32_t crc32(uint32_t crc, const uint8_t *data, size_t len)
+{
+	if (!table_ready)
+		crc32_init();
+
+	crc = ~crc;
+	while (len--)
+		crc = table[(crc ^ *data++) & 0xff] ^ (crc >> 8);
+	return ~crc;
+}
@@ -0,0 +1,8 @@
+#pragma once
+
+#include <stddef.h>
+#include <stdint.h>
+
+// CRC-32 (IEEE 802.3), same as zlib.crc32 on the host.
+// Pass 0 as crc for the first call, and the previous result to continue.
+uint32_t crc32(uint32_t crc, const uint8_t *data, size_t len);
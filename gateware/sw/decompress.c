@@ -0,0 +1,90 @@
+#include "decompress.h"
+
+enum {
+	STATE_TOKEN,
+	STATE_LITERALS,
+	STATE_MATCH_HI,
+	STATE_MATCH_LO,
+	STATE_RUN_HI,
+	STATE_RUN_LO,
+	STATE_RUN_VALUE,
+};
+
+void decompress_init(struct decompress *d, uint8_t *out, uint32_t length)
+{
+	d->start = out;
+	d->out = out;
+	d->end = out + length;
+	d->state = STATE_TOKEN;
+	d->count = 0;
+	d->arg = 0;
+	d->error = 0;
+}
+
+static int fits(struct decompress *d, uint32_t n)
+{
+	if (n > (uint32_t) (d->end - d->out)) {
+		d->error = 1;
+		return 0;
+	}
+	return 1;
+}
+
+void decompress_feed(struct decompress *d, const uint8_t *data, uint32_t len)
+{
+	while (len && !d->error && d->out < d->end) {
+		uint8_t c = *data++;
+		len--;
+
+		switch (d->state) {
+		case STATE_TOKEN:
+			if (c < 0x80) {
+				d->count = c + 1;
+				d->state = fits(d, d->count) ? STATE_LITERALS : STATE_TOKEN;
+			} else if (c < 0xff) {
+				d->count = c - 0x80 + 4;
+				d->state = STATE_MATCH_HI;
+			} else {
+				d->state = STATE_RUN_HI;
+			}
+			break;
+		case STATE_LITERALS:
+			*d->out++ = c;
+			if (--d->count == 0)
+				d->state = STATE_TOKEN;
+			break;
+		case STATE_MATCH_HI:
+			d->arg = c << 8;
+			d->state = STATE_MATCH_LO;
+			break;
+		case STATE_MATCH_LO: {
+			uint32_t distance = d->arg | c;
+			if (distance == 0 || distance > (uint32_t) (d->out - d->start) || !fits(d, d->count)) {
+				d->error = 1;
+				break;
+			}
+			// Byte by byte, the source may overlap the output
+			const uint8_t *src = d->out - distance;
+			for (uint32_t i = 0; i < d->count; i++)
+				*d->out++ = *src++;
+			d->state = STATE_TOKEN;
+			break;
+		}
+		case STATE_RUN_HI:
+			d->arg = c << 8;
+			d->state = STATE_RUN_LO;
+			break;
+		case STATE_RUN_LO:
+			d->count = d->arg | c;
+			d->state = STATE_RUN_VALUE;
+			break;
+		case STATE_RUN_VALUE:
+			if (!fits(d, d->count))
+				break;
+			for (uint32_t i = 0; i < d->count; i++)
+				*d->out++ = c;
+			d->state = STATE_TOKEN;
+			break;
+		}
+	}
+}
@@ -0,0 +1,29 @@
+#pragma once
+
+#include <stdint.h>
+
+// Streaming decoder for the host's util/compress.py format:
+//   0x00-0x7f  literals: the next c+1 bytes are copied to the output
+//   0x80-0xfe  match: copy c-0x80+4 bytes from `distance` bytes back,
+//              distance follows as u16be, may overlap
+//   0xff       run: u16be length followed by the byte value
+// Input can be fed in pieces of any size. Bytes after the output is
+// complete are ignored, so the stream may be padded.
+
+struct decompress {
+	uint8_t *start;
+	uint8_t *out;
+	uint8_t *end;
+	int state;
+	uint32_t count;
+	uint32_t arg;
+	int error;
+};
+
+void decompress_init(struct decompress *d, uint8_t *out, uint32_t length);
+void decompress_feed(struct decompress *d, const uint8_t *data, uint32_t len);
+
+static inline int decompress_done(struct decompress *d)
+{
+	return d->out == d->end;
+}
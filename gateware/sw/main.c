@@ -6,11 +6,14 @@
 #include <string.h>
 
 #include <irq.h>
+#include <system.h>
 #include <uart.h>
 #include <console.h>
 #include <generated/csr.h>
 #include <generated/mem.h>
 
+#include "crc32.h"
+#include "decompress.h"
 #include "sha256.h"
 #include "cic.h"
 
@@ -92,8 +95,12 @@ static void help(void)
 	puts("mem_read           - Read memory: <address> <length>");
 	puts("mem_write          - Write memory: <address> <bytes> <value>");
 	puts("mem_load           - Load raw bytes [32b]: <address> <length>");
+	puts("mem_load_block     - Load raw blocks [32b]: <address> <block_size> <index> <count>");
+	puts("mem_load_compressed - Load a compressed stream: <address> <length> <stream_length>");
+	puts("mem_load_framed    - Load CRC checked frames [32b]: <address> <length> <frame_size> [stream_length]");
 	puts("mem_dump           - Hexdump [32b]: <address> <length>");
 	puts("sha256             - Calculate SHA256 hash of memory: <address> <length>");
+	puts("sha256_blocks      - SHA256 hash of each block: <address> <length> <block_size>");
 	puts("set_header         - Overrides the first word of the rom: <value>");
 	puts("");
 }
@@ -166,19 +173,13 @@ static void mem_write(char *address_str, char *len_str, char *value_str)
 	}
 }
 
-static void mem_load(char *address_str, char *len_str)
+static void load_words(uint32_t *address, uint32_t words)
 {
-	char *c;
-	uint32_t *address = (uint32_t *) strtoul(address_str, &c, 0);
-	uint32_t words = (strtoul(len_str, &c, 0) + 3) / 4;
-
 	union {
 		uint32_t word;
 		uint8_t  byte[4];
 	} value;
 
-	printf("Reading %ld words\n", words);
-
 	for (int i = 0; i < words; i++) {
 		value.byte[0] = readchar();
 		value.byte[1] = readchar();
@@ -188,6 +189,240 @@ static void mem_load(char *address_str, char *len_str)
 	}
 }
 
+static void mem_load(char *address_str, char *len_str)
+{
+	char *c;
+	uint32_t *address = (uint32_t *) strtoul(address_str, &c, 0);
+	uint32_t words = (strtoul(len_str, &c, 0) + 3) / 4;
+
+	printf("Reading %ld words\n", words);
+	load_words(address, words);
+}
+
+static void mem_load_block(char *address_str, char *block_size_str, char *index_str, char *count_str)
+{
+	char *c;
+	uint32_t base = strtoul(address_str, &c, 0);
+	uint32_t block_size = strtoul(block_size_str, &c, 0) & ~3;
+	uint32_t index = strtoul(index_str, &c, 0);
+	uint32_t count = strtoul(count_str, &c, 0);
+	uint32_t *address = (uint32_t *) (base + index * block_size);
+
+	printf("Reading %ld blocks at 0x%08lx\n", count, (uint32_t) address);
+	load_words(address, count * (block_size / 4));
+}
+
+/*
+ * Framed load, host to device:
+ *   a5 5a | index u32 | length u16 | payload | crc32 u32
+ * All fields are little-endian, the CRC covers index, length and payload.
+ * Frame `index` is written to address + index * frame_size, its length is
+ * frame_size except for the last frame, both rounded up to a whole word.
+ *
+ * Device to host, after every frame:
+ *   06 | next u32    ACK, all frames before `next` are written
+ *   15 | next u32    NAK, frame `next` was lost or corrupted. Only sent
+ *                    once until `next` arrives intact, later frames are
+ *                    dropped so the host resends from `next`. Also sent
+ *                    while no frames arrive.
+ *
+ * With a stream_length the frames carry that many bytes of compressed
+ * stream instead, which is decompressed into `length` bytes at address.
+ *
+ * A valid frame with index ffffffff aborts the load. When all frames are
+ * in, the SHA256 of the loaded region is printed for the host to check.
+ */
+#define FRAME_SYNC0       0xa5
+#define FRAME_SYNC1       0x5a
+#define FRAME_ACK         0x06
+#define FRAME_NAK         0x15
+#define FRAME_ABORT       0xffffffff
+#define FRAME_MAX_SIZE    4096
+#define FRAME_IDLE_SPINS  50000000
+#define FRAME_NUDGES      10
+
+static int read_byte(uint8_t *c)
+{
+	for (uint32_t i = 0; i < FRAME_IDLE_SPINS; i++) {
+		if (readchar_nonblock()) {
+			*c = readchar();
+			return 1;
+		}
+	}
+	return 0;
+}
+
+static int read_bytes(uint8_t *data, uint32_t len)
+{
+	for (uint32_t i = 0; i < len; i++) {
+		if (!read_byte(&data[i]))
+			return 0;
+	}
+	return 1;
+}
+
+static void frame_reply(uint8_t type, uint32_t next)
+{
+	// Raw bytes, putchar would expand \n
+	uart_write(type);
+	uart_write(next & 0xff);
+	uart_write((next >> 8) & 0xff);
+	uart_write((next >> 16) & 0xff);
+	uart_write((next >> 24) & 0xff);
+}
+
+/*
+ * Waits for the start of the next frame. While the link is idle, frame
+ * `next` is NAKed every FRAME_IDLE_SPINS / FRAME_NUDGES spins, so the host
+ * resends it if the last frames of a load were lost.
+ */
+static int read_sync(uint8_t *c, uint32_t next)
+{
+	for (int i = 0; i < FRAME_NUDGES; i++) {
+		for (uint32_t j = 0; j < FRAME_IDLE_SPINS / FRAME_NUDGES; j++) {
+			if (readchar_nonblock()) {
+				*c = readchar();
+				return 1;
+			}
+		}
+		frame_reply(FRAME_NAK, next);
+	}
+	return 0;
+}
+
+static void mem_load_framed(char *address_str, char *len_str, char *frame_size_str, char *stream_len_str)
+{
+	char *c;
+	uint8_t *address = (uint8_t *) strtoul(address_str, &c, 0);
+	uint32_t len = strtoul(len_str, &c, 0);
+	uint32_t frame_size = strtoul(frame_size_str, &c, 0);
+	int compressed = *stream_len_str != 0;
+	uint32_t payload_len = compressed ? strtoul(stream_len_str, &c, 0) : len;
+	uint32_t frames, next = 0;
+	int nak_sent = 0;
+	BYTE hash_str[65];
+	struct decompress d;
+
+	static uint32_t payload[FRAME_MAX_SIZE / 4];
+	uint8_t header[6];
+	uint8_t crc_bytes[4];
+
+	if (frame_size == 0 || frame_size > FRAME_MAX_SIZE || frame_size % 4) {
+		printf("Invalid frame size, must be a multiple of 4 up to %d\n", FRAME_MAX_SIZE);
+		return;
+	}
+	frames = (payload_len + frame_size - 1) / frame_size;
+	decompress_init(&d, address, len);
+	puts("framed_load ready");
+
+	while (next < frames) {
+		uint8_t sync;
+		uint32_t index, length, expected, crc;
+
+		if (!read_sync(&sync, next))
+			goto timeout;
+		if (sync != FRAME_SYNC0)
+			continue;
+		if (!read_byte(&sync))
+			goto timeout;
+		if (sync != FRAME_SYNC1)
+			continue;
+
+		if (!read_bytes(header, sizeof(header)))
+			goto timeout;
+		index = header[0] | (header[1] << 8) | (header[2] << 16) | ((uint32_t) header[3] << 24);
+		length = header[4] | (header[5] << 8);
+		if (length > frame_size) {
+			// Corrupted header, hunt for the next sync
+			if (!nak_sent)
+				frame_reply(FRAME_NAK, next);
+			nak_sent = 1;
+			continue;
+		}
+
+		if (!read_bytes((uint8_t *) payload, length) || !read_bytes(crc_bytes, sizeof(crc_bytes)))
+			goto timeout;
+		crc = crc_bytes[0] | (crc_bytes[1] << 8) | (crc_bytes[2] << 16) | ((uint32_t) crc_bytes[3] << 24);
+		if (crc != crc32(crc32(0, header, sizeof(header)), (uint8_t *) payload, length)) {
+			if (!nak_sent)
+				frame_reply(FRAME_NAK, next);
+			nak_sent = 1;
+			continue;
+		}
+
+		if (index == FRAME_ABORT) {
+			puts("\nframed_load aborted");
+			return;
+		}
+		if (index < next) {
+			// Duplicate, our ACK was probably lost
+			frame_reply(FRAME_ACK, next);
+			continue;
+		}
+		expected = payload_len - index * frame_size;
+		if (expected > frame_size)
+			expected = frame_size;
+		expected = (expected + 3) & ~3;
+		if (index > next || length != expected) {
+			if (!nak_sent)
+				frame_reply(FRAME_NAK, next);
+			nak_sent = 1;
+			continue;
+		}
+
+		if (compressed) {
+			decompress_feed(&d, (uint8_t *) payload, length);
+		} else {
+			uint32_t *dst = (uint32_t *) (address + index * frame_size);
+			for (uint32_t i = 0; i < length / 4; i++)
+				dst[i] = payload[i];
+		}
+
+		next++;
+		nak_sent = 0;
+		frame_reply(FRAME_ACK, next);
+	}
+
+	if (compressed && (d.error || !decompress_done(&d))) {
+		printf("\nframed_load error at 0x%08lx\n", (uint32_t) d.out);
+		return;
+	}
+	sha256_to_string(hash_str, address, len);
+	printf("\nframed_load sha256 %s\n", (char *) hash_str);
+	return;
+
+timeout:
+	puts("\nframed_load timeout");
+}
+
+/*
+ * There is no flow control. A run expands into many SDRAM writes per input
+ * byte, so a dense stream can overrun the UART RX FIFO. Prefer
+ * mem_load_framed with a stream_length, which resends what was lost.
+ */
+static void mem_load_compressed(char *address_str, char *len_str, char *stream_len_str)
+{
+	char *c;
+	uint8_t *address = (uint8_t *) strtoul(address_str, &c, 0);
+	uint32_t len = strtoul(len_str, &c, 0);
+	uint32_t stream_len = strtoul(stream_len_str, &c, 0);
+	struct decompress d;
+
+	decompress_init(&d, address, len);
+	printf("Reading %ld bytes into %ld\n", stream_len, len);
+
+	// Always consume the whole stream so a bad one doesn't end up on the console
+	for (uint32_t i = 0; i < stream_len; i++) {
+		uint8_t value = readchar();
+		decompress_feed(&d, &value, 1);
+	}
+
+	if (d.error || !decompress_done(&d))
+		printf("compressed_load error at 0x%08lx\n", (uint32_t) d.out);
+	else
+		puts("compressed_load done");
+}
+
 static void mem_dump(char *address_str, char *len_str)
 {
 	char *c;
@@ -220,6 +455,16 @@ static void mem_dump(char *address_str, char *len_str)
 	}
 }
 
+/*
+ * main_ram is also written over the Wishbone bridge, behind the CPU's
+ * back, so drop cached lines before hashing it.
+ */
+static void flush_caches(void)
+{
+	flush_cpu_dcache();
+	flush_l2_cache();
+}
+
 static void sha256(char *address_str, char *len_str)
 {
 	char *c;
@@ -227,10 +472,34 @@ static void sha256(char *address_str, char *len_str)
 	uint32_t len = strtoul(len_str, &c, 0);
 	BYTE hash_str[65];
 
+	flush_caches();
 	sha256_to_string(hash_str, address, len);
 	puts((char *) hash_str);
 }
 
+static void sha256_blocks(char *address_str, char *len_str, char *block_size_str)
+{
+	char *c;
+	BYTE *address = (BYTE *) strtoul(address_str, &c, 0);
+	uint32_t len = strtoul(len_str, &c, 0);
+	uint32_t block_size = strtoul(block_size_str, &c, 0);
+	BYTE hash_str[65];
+
+	if (block_size == 0)
+		return;
+
+	flush_caches();
+
+	// One "block <index> <hash>" line per block, the last one may be short
+	for (uint32_t i = 0; i * block_size < len; i++) {
+		uint32_t n = len - i * block_size;
+		if (n > block_size)
+			n = block_size;
+		sha256_to_string(hash_str, address + i * block_size, n);
+		printf("block %ld %s\n", i, (char *) hash_str);
+	}
+}
+
 static void set_header(char *value_str)
 {
 	char *c;
@@ -276,6 +545,26 @@ static void console_service(void)
 		char *len = get_token(&str);
 		mem_load(addr, len);
 	}
+	else if(strcmp(token, "mem_load_block") == 0) {
+		char *addr = get_token(&str);
+		char *block_size = get_token(&str);
+		char *index = get_token(&str);
+		char *count = get_token(&str);
+		mem_load_block(addr, block_size, index, count);
+	}
+	else if(strcmp(token, "mem_load_framed") == 0) {
+		char *addr = get_token(&str);
+		char *len = get_token(&str);
+		char *frame_size = get_token(&str);
+		char *stream_len = get_token(&str);
+		mem_load_framed(addr, len, frame_size, stream_len);
+	}
+	else if(strcmp(token, "mem_load_compressed") == 0) {
+		char *addr = get_token(&str);
+		char *len = get_token(&str);
+		char *stream_len = get_token(&str);
+		mem_load_compressed(addr, len, stream_len);
+	}
 	else if(strcmp(token, "mem_dump") == 0) {
 		char *addr = get_token(&str);
 		char *len = get_token(&str);
@@ -286,6 +575,12 @@ static void console_service(void)
 		char *len = get_token(&str);
 		sha256(addr, len);
 	}
+	else if(strcmp(token, "sha256_blocks") == 0) {
+		char *addr = get_token(&str);
+		char *len = get_token(&str);
+		char *block_size = get_token(&str);
+		sha256_blocks(addr, len, block_size);
+	}
 	else if(strcmp(token, "set_header") == 0) {
 		char *value = get_token(&str);
 		set_header(value);